@@ -0,0 +1,171 @@
+"""
+Benchmark for serial/PIN extraction.
+
+Builds a large synthetic corpus of Info cells in the formats seen in real
+spreadsheets, checks that extract_serial_pin gives exactly the same answers
+as the original implementation (kept below as the reference), and times both.
+
+    python bench_extraction.py
+    python bench_extraction.py --rows 500000 --min-speedup 1.2
+
+Exits with a non-zero status if any result differs from the reference or the
+speedup falls below --min-speedup, so it can be used as a regression check.
+"""
+import argparse
+import random
+import re
+import string
+import sys
+import time
+
+from voucher_automation_simple import extract_serial_pin, extract_serial_pin_batch
+
+def reference_extract_serial_pin(info_text):
+    """
+    The original extract_serial_pin, compiling its patterns on every call.
+    """
+    # Remove any leading/trailing whitespace
+    if not info_text:
+        return None, None
+    
+    info_text = info_text.strip()
+    
+    pattern = r'(?:virgin\s*(?:exp|)|)?\s*([a-z0-9]{7,9})\s*(?:pin\s*)?([a-z0-9]{4})'
+    match = re.search(pattern, info_text, re.IGNORECASE)
+    
+    if match:
+        serial = match.group(1)
+        pin = match.group(2)
+        return serial, pin
+    
+    words = re.findall(r'[a-z0-9]+', info_text, re.IGNORECASE)
+    for i in range(len(words) - 1):
+        if 7 <= len(words[i]) <= 9 and len(words[i+1]) == 4:
+            return words[i], words[i+1]
+    
+    if "correct SN:" in info_text:
+        corrected_sn_match = re.search(r'correct SN:\s*([a-z0-9]{7,9})', info_text, re.IGNORECASE)
+        if corrected_sn_match:
+            corrected_sn = corrected_sn_match.group(1)
+            pin_match = re.search(r'([a-z0-9]{4})', info_text, re.IGNORECASE)
+            if pin_match:
+                return corrected_sn, pin_match.group(1)
+    
+    if "correct PIN:" in info_text:
+        corrected_pin_match = re.search(r'correct PIN:\s*([a-z0-9]{4})', info_text, re.IGNORECASE)
+        if corrected_pin_match:
+            corrected_pin = corrected_pin_match.group(1)
+            serial_match = re.search(r'([a-z0-9]{7,9})', info_text, re.IGNORECASE)
+            if serial_match:
+                return serial_match.group(1), corrected_pin
+    
+    return None, None
+
+PIN_CHARACTERS = string.ascii_uppercase + string.digits
+
+def random_serial(rng):
+    if rng.random() < 0.7:
+        return "E" + str(rng.randint(1000000, 99999999))
+    return str(rng.randint(1000000, 9999999))
+
+def random_pin(rng):
+    return "".join(rng.choice(PIN_CHARACTERS) for _ in range(4))
+
+# Info cell layouts, from the README examples and variations found in exports
+TEMPLATES = [
+    "Virgin Exp {serial} {pin}",
+    "Virgin {serial} {pin}",
+    "VirginEXP {serial} {pin}",
+    "virgin exp {serial}  {pin}",
+    "{serial} {pin}",
+    "{serial} PIN {pin}",
+    "{serial} pin: {pin}",
+    "{serial}-{pin}",
+    "{serial} / {pin}",
+    "Virgin Exp {serial}, {pin} (customer called)",
+    "  Virgin E-voucher {serial}\t{pin}  ",
+    "correct SN: {serial}, original pin {pin}",
+    "SN {serial}x, correct PIN: {pin}",
+    "{serial}",
+    "Virgin voucher - see email",
+    "",
+    "N/A",
+]
+
+def build_corpus(rows, seed=1):
+    """
+    Generate synthetic Info cells.
+    
+    Args:
+        rows (int): Number of cells to generate
+        seed (int): Random seed, so runs are comparable
+    
+    Returns:
+        list: Cell texts
+    """
+    rng = random.Random(seed)
+    weights = [20, 15, 5, 5, 15, 5, 3, 3, 3, 5, 3, 2, 2, 3, 3, 4, 2]
+    corpus = []
+    for _ in range(rows):
+        template = rng.choices(TEMPLATES, weights)[0]
+        cell = template.format(serial=random_serial(rng), pin=random_pin(rng))
+        if rng.random() < 0.3:
+            cell = cell.lower()
+        corpus.append(cell)
+    return corpus
+
+def time_best(function, corpus, repeats):
+    best = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function(corpus)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark serial/PIN extraction")
+    parser.add_argument("--rows", type=int, default=200000, help="Cells in the synthetic corpus (default: 200000)")
+    parser.add_argument("--repeats", type=int, default=3, help="Timing runs, best is reported (default: 3)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for the corpus (default: 1)")
+    parser.add_argument("--min-speedup", type=float, default=None,
+                        help="Fail if the per-cell speedup over the reference is below this")
+    args = parser.parse_args(argv)
+    
+    corpus = build_corpus(args.rows, args.seed)
+    print(f"Corpus: {len(corpus)} cells, {len(set(corpus))} distinct")
+    
+    # Results must be identical to the reference implementation
+    expected = [reference_extract_serial_pin(cell) for cell in corpus]
+    mismatches = [
+        (cell, want, got)
+        for cell, want, got in zip(corpus, expected, (extract_serial_pin(cell) for cell in corpus))
+        if want != got
+    ]
+    if extract_serial_pin_batch(corpus) != expected:
+        mismatches.append(("<batch>", "reference results", "different batch results"))
+    for cell, want, got in mismatches[:10]:
+        print(f"MISMATCH {cell!r}: expected {want}, got {got}")
+    if mismatches:
+        print(f"{len(mismatches)} results differ from the reference")
+        return 1
+    failures = sum(1 for serial, pin in expected if not serial)
+    print(f"Results identical to the reference ({failures} cells with no serial/PIN)")
+    
+    reference_time = time_best(lambda cells: [reference_extract_serial_pin(cell) for cell in cells], corpus, args.repeats)
+    single_time = time_best(lambda cells: [extract_serial_pin(cell) for cell in cells], corpus, args.repeats)
+    batch_time = time_best(extract_serial_pin_batch, corpus, args.repeats)
+    
+    for name, elapsed in (("reference", reference_time), ("extract_serial_pin", single_time),
+                          ("extract_serial_pin_batch", batch_time)):
+        print(f"{name:26} {elapsed:8.3f}s  {len(corpus) / elapsed:12,.0f} cells/s  "
+              f"{reference_time / elapsed:5.2f}x")
+    
+    speedup = reference_time / single_time
+    if args.min_speedup is not None and speedup < args.min_speedup:
+        print(f"Speedup {speedup:.2f}x is below the required {args.min_speedup:.2f}x")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""
+End-to-end throughput benchmark against the local stand-in site.
+
+Starts mock_acorne_server on a free port, writes a synthetic spreadsheet, runs
+the real automation against it (no login, no ledger, outputs in a temporary
+directory) and reports vouchers per second, lookup latency percentiles and
+error rates, so performance changes can be measured offline.
+
+    python bench_throughput.py --rows 300 --engine http --workers 4 --latency-ms 100
+    python bench_throughput.py --rows 50 --engine browser --blank-rate 0.05
+    python bench_throughput.py --rows 100 --engine browser --tabs 4 --latency-ms 300
+
+The browser engine needs Chrome and ChromeDriver as for a normal run.
+"""
+import argparse
+import collections
+import contextlib
+import csv
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import mock_acorne_server
+import voucher_automation_simple
+
+def write_spreadsheet(path, rows, seed=1):
+    """
+    Write a synthetic input sheet with one voucher per row.
+    
+    Args:
+        path (str): CSV file to create
+        rows (int): Number of voucher rows
+        seed (int): Random seed, so runs are comparable
+    """
+    rng = random.Random(seed)
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(["Date", "Customer", "Info", "Satus"])
+        for number in range(rows):
+            serial = "E" + str(rng.randint(1000000, 99999999))
+            pin = "".join(rng.choice("ABCDEFGHJKLMNPQRSTUVWXYZ23456789") for _ in range(4))
+            writer.writerow(["01/03/2025", f"Customer {number}", f"Virgin Exp {serial} {pin}", ""])
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+def summarise(records, config, elapsed, server_stats):
+    """
+    Build the benchmark summary from the run's journal records.
+    
+    Args:
+        records (dict): Journal records keyed by row index
+        config (MockSiteConfig): Behaviour of the stand-in site
+        elapsed (float): Wall time of the run in seconds
+        server_stats (dict): Request counters from the stand-in
+    
+    Returns:
+        dict: Throughput, latency and error figures
+    """
+    latencies = sorted(record["seconds"] for record in records.values() if record.get("seconds") is not None)
+    outcomes = collections.Counter(record.get("outcome") or "unrecognised" for record in records.values())
+    
+    # Lookups that reached a page must have reached the page the stand-in chose
+    wrong = sum(
+        1 for record in records.values()
+        if record.get("outcome") and record["outcome"] != mock_acorne_server.expected_outcome(
+            record["serial"], record["pin"], config)
+    )
+    
+    lookups = len(records)
+    return {
+        "lookups": lookups,
+        "seconds": round(elapsed, 3),
+        "vouchers_per_second": round(lookups / elapsed, 3) if elapsed else 0.0,
+        "latency_p50": round(percentile(latencies, 0.50), 4),
+        "latency_p90": round(percentile(latencies, 0.90), 4),
+        "latency_p99": round(percentile(latencies, 0.99), 4),
+        "latency_max": round(latencies[-1], 4) if latencies else 0.0,
+        "outcomes": dict(outcomes),
+        "unrecognised_rate": round(outcomes["unrecognised"] / lookups, 4) if lookups else 0.0,
+        "wrong_results": wrong,
+        "server": server_stats,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput benchmark against the local stand-in site")
+    parser.add_argument("--rows", type=int, default=200, help="Vouchers in the synthetic sheet (default: 200)")
+    parser.add_argument("--engine", choices=["browser", "http"], default="http",
+                        help="Automation engine to benchmark (default: http)")
+    parser.add_argument("--workers", type=int, default=1, help="Parallel sessions (default: 1)")
+    parser.add_argument("--tabs", type=int, default=1,
+                        help="Lookups in flight per Chrome, one per tab (browser engine; default: 1)")
+    parser.add_argument("--throttle", choices=["adaptive", "fixed"], default="adaptive",
+                        help="Pacing mode passed to the automation (default: adaptive)")
+    parser.add_argument("--min-delay", type=float, default=0.0,
+                        help="Shortest gap between lookups for the adaptive throttle (default: 0)")
+    parser.add_argument("--max-delay", type=float, default=2.0,
+                        help="Longest back-off for the adaptive throttle, kept low so injected "
+                             "failures do not dominate the run (default: 2)")
+    parser.add_argument("--outcome-timeout", type=float, default=voucher_automation_simple.OUTCOME_TIMEOUT,
+                        help="Seconds to wait for each result page")
+    parser.add_argument("--json", dest="json_file", help="Also write the summary to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="Show the automation's own output")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary sheet and results")
+    mock_acorne_server.add_config_arguments(parser)
+    args = parser.parse_args(argv)
+    
+    config = mock_acorne_server.config_from_args(args)
+    server = mock_acorne_server.start_server(config)
+    work_dir = tempfile.mkdtemp(prefix="voucher_bench_")
+    try:
+        sheet = os.path.join(work_dir, "bench_vouchers.csv")
+        write_spreadsheet(sheet, args.rows)
+        
+        automation_args = [
+            sheet,
+            "--site-url", server.search_url,
+            "--engine", args.engine,
+            "--workers", str(args.workers),
+            "--tabs", str(args.tabs),
+            "--throttle", args.throttle,
+            "--min-delay", str(args.min_delay),
+            "--max-delay", str(args.max_delay),
+            "--outcome-timeout", str(args.outcome_timeout),
+            "--output-dir", work_dir,
+            "--no-login", "--no-open", "--no-ledger",
+        ]
+        print(f"Running {args.rows} vouchers through the {args.engine} engine with {args.workers} worker(s) "
+              f"against {server.search_url}")
+        
+        output = sys.stdout if args.verbose else io.StringIO()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(output):
+            voucher_automation_simple.main(automation_args)
+        elapsed = time.perf_counter() - started
+        
+        journal = voucher_automation_simple.journal_path_for(sheet, work_dir)
+        records = voucher_automation_simple.read_journal(journal) if os.path.exists(journal) else {}
+        with server.stats_lock:
+            server_stats = dict(server.stats)
+        summary = summarise(records, config, elapsed, server_stats)
+    finally:
+        server.shutdown()
+        if args.keep:
+            print(f"Sheet and results kept in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print(f"Lookups:      {summary['lookups']} in {summary['seconds']:.2f}s "
+          f"({summary['vouchers_per_second']:.2f} vouchers/s)")
+    print(f"Latency:      p50 {summary['latency_p50'] * 1000:.0f}ms  p90 {summary['latency_p90'] * 1000:.0f}ms  "
+          f"p99 {summary['latency_p99'] * 1000:.0f}ms  max {summary['latency_max'] * 1000:.0f}ms")
+    print(f"Outcomes:     {', '.join(f'{name}={count}' for name, count in sorted(summary['outcomes'].items()))}")
+    print(f"Error rate:   {summary['unrecognised_rate']:.2%} unrecognised, {summary['wrong_results']} wrong results")
+    
+    if args.json_file:
+        with open(args.json_file, 'w', encoding='utf-8') as file:
+            json.dump(summary, file, indent=2)
+    
+    if summary["lookups"] < args.rows:
+        print(f"Only {summary['lookups']} of {args.rows} vouchers were looked up")
+        return 1
+    return 1 if summary["wrong_results"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
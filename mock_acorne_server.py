@@ -0,0 +1,357 @@
+"""
+Local stand-in for the Acorne SVS voucher search site.
+
+Serves a search.aspx page with the same element IDs and page structure that
+process_voucher relies on (the search form, the invalid serial/PIN error
+block, the claim page and the success page, each with its Abandon link), so
+the automation can be run and timed without touching the live site.
+
+    python mock_acorne_server.py --port 8765 --latency-ms 150 --blank-rate 0.02
+
+then point the automation at it:
+
+    python voucher_automation_simple.py vouchers.csv --site-url http://127.0.0.1:8765/vouchers/search.aspx --no-login
+
+Which page a voucher gets is worked out from its serial and PIN, so the same
+voucher always gets the same answer (see expected_outcome).
+"""
+import argparse
+import html
+import itertools
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+SEARCH_PATH = "/vouchers/search.aspx"
+LOGIN_PATH = "/vouchers/login.aspx"
+AUTH_COOKIE = "MockAcorneAuth"
+
+# Page states, matching the OUTCOME_* names used by the automation
+SUCCESS = "success_page"
+CLAIM = "claim_page"
+INVALID = "invalid"
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+    <title>Acorne SVS - Voucher Search (local stand-in)</title>
+</head>
+<body>
+<div id="wrapper">
+<form method="post" action="./search.aspx" id="aspnetForm">
+<div class="aspNetHidden">
+<input type="hidden" name="__EVENTTARGET" id="__EVENTTARGET" value="" />
+<input type="hidden" name="__EVENTARGUMENT" id="__EVENTARGUMENT" value="" />
+<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="{viewstate}" />
+</div>
+<script type="text/javascript">
+var theForm = document.forms['aspnetForm'];
+function __doPostBack(eventTarget, eventArgument) {{
+    if (!theForm.onsubmit || (theForm.onsubmit() != false)) {{
+        theForm.__EVENTTARGET.value = eventTarget;
+        theForm.__EVENTARGUMENT.value = eventArgument;
+        theForm.submit();
+    }}
+}}
+</script>
+<div class="aspNetHidden">
+<input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="{eventvalidation}" />
+</div>
+<div id="header"><h1>Voucher Search</h1></div>
+<div id="nav"></div>
+<div id="content">
+{content}
+</div>
+</form>
+</div>
+</body>
+</html>
+"""
+
+SEARCH_CONTENT = """<div class="messages">
+    <div>{message}</div>
+</div>
+<div class="search">
+    <label for="ctl00_cphMain_tbxSerialNo">Serial No</label>
+    <input name="ctl00$cphMain$tbxSerialNo" type="text" id="ctl00_cphMain_tbxSerialNo" />
+    <label for="ctl00_cphMain_tbxPinNo">PIN</label>
+    <input name="ctl00$cphMain$tbxPinNo" type="text" id="ctl00_cphMain_tbxPinNo" />
+    <input type="submit" name="ctl00$cphMain$btnLookup" value="Lookup" id="ctl00_cphMain_btnLookup" />
+</div>"""
+
+ERROR_MESSAGE = '<div class="error msg-block">The serial number or PIN you entered is not valid.</div>'
+
+ABANDON_LINK = (
+    '<a id="ctl00_cphMain_lbtnAbandon" '
+    'href="javascript:__doPostBack(&#39;ctl00$cphMain$lbtnAbandon&#39;,&#39;&#39;)">Abandon</a>'
+)
+
+RESULT_CONTENT = """<div>
+    <div class="summary">Voucher {serial}</div>
+    <div class="details">
+        <fieldset>
+            <table>
+                <tbody>
+{rows}
+                </tbody>
+            </table>
+        </fieldset>
+    </div>
+</div>"""
+
+LOGIN_PAGE = """<!DOCTYPE html>
+<html>
+<head><title>Acorne SVS - Log in (local stand-in)</title></head>
+<body>
+<form method="post" action="./login.aspx">
+    <label>User <input type="text" name="user" /></label>
+    <label>Password <input type="password" name="password" /></label>
+    <input type="submit" value="Log in" />
+</form>
+</body>
+</html>
+"""
+
+class MockSiteConfig:
+    """Behaviour of the stand-in site."""
+    
+    def __init__(self, success_rate=0.5, claim_rate=0.2, latency_ms=0, jitter_ms=0,
+                 error_rate=0.0, blank_rate=0.0, require_login=False, seed=None):
+        """
+        Args:
+            success_rate (float): Share of vouchers that get the success page
+            claim_rate (float): Share of vouchers that get the claim page;
+                the rest get the invalid serial/PIN error
+            latency_ms (float): Delay added to every response
+            jitter_ms (float): Random extra delay of up to this much
+            error_rate (float): Share of lookups answered with an HTTP 500
+            blank_rate (float): Share of lookups answered with a page that
+                matches none of the known states
+            require_login (bool): Redirect to a login page until the login
+                form has been submitted
+            seed (int): Seed for the latency and failure injection
+        """
+        self.success_rate = success_rate
+        self.claim_rate = claim_rate
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.blank_rate = blank_rate
+        self.require_login = require_login
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+    
+    def chance(self):
+        with self.random_lock:
+            return self.random.random()
+
+def expected_outcome(serial, pin, config):
+    """
+    The page the stand-in shows for a voucher, ignoring injected failures.
+    
+    Args:
+        serial (str): Serial number
+        pin (str): PIN
+        config (MockSiteConfig): Site behaviour
+    
+    Returns:
+        str: SUCCESS, CLAIM or INVALID
+    """
+    bucket = zlib.crc32(f"{serial.strip().upper()}|{pin.strip().upper()}".encode()) % 10000 / 10000
+    if bucket < config.success_rate:
+        return SUCCESS
+    if bucket < config.success_rate + config.claim_rate:
+        return CLAIM
+    return INVALID
+
+class MockAcorneHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockAcorne/1.0"
+    # Headers and body go out in separate writes; with Nagle on, the delayed
+    # ACK would add ~40 ms to every response and skew the benchmark
+    disable_nagle_algorithm = True
+    
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+    
+    @property
+    def config(self):
+        return self.server.config
+    
+    def _count(self, key):
+        with self.server.stats_lock:
+            self.server.stats[key] = self.server.stats.get(key, 0) + 1
+    
+    def _delay(self):
+        delay = self.config.latency_ms
+        if self.config.jitter_ms:
+            delay += self.config.chance() * self.config.jitter_ms
+        if delay:
+            time.sleep(delay / 1000)
+    
+    def _send(self, status, body, content_type="text/html; charset=utf-8", headers=()):
+        payload = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+    
+    def _send_page(self, content):
+        viewstate = f"mock{next(self.server.viewstates)}"
+        self._send(200, PAGE_TEMPLATE.format(
+            viewstate=viewstate, eventvalidation="ev" + viewstate, content=content
+        ))
+    
+    def _logged_in(self):
+        if not self.config.require_login:
+            return True
+        return f"{AUTH_COOKIE}=" in (self.headers.get("Cookie") or "")
+    
+    def _redirect(self, location, headers=()):
+        self._send(302, "", headers=(("Location", location),) + tuple(headers))
+    
+    def _search_page(self, message=""):
+        self._send_page(SEARCH_CONTENT.format(message=message))
+    
+    def _result_page(self, serial, outcome):
+        rows = [f"                    <tr><td>Detail {number}</td><td></td></tr>" for number in range(1, 12)]
+        if outcome == CLAIM:
+            rows.append("                    <tr><td>Status</td><td>Available</td></tr>")
+            rows.append(
+                '                    <tr><td><input type="submit" name="ctl00$cphMain$btnClaim" '
+                f'value="Claim" id="ctl00_cphMain_btnClaim" /> {ABANDON_LINK}</td><td></td></tr>'
+            )
+        else:
+            rows.append(f"                    <tr><td>{ABANDON_LINK}</td><td>Redeemed</td></tr>")
+        self._send_page(RESULT_CONTENT.format(serial=html.escape(serial), rows="\n".join(rows)))
+    
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/stats":
+            with self.server.stats_lock:
+                return self._send(200, json.dumps(self.server.stats), "application/json")
+        if path == LOGIN_PATH:
+            return self._send(200, LOGIN_PAGE)
+        if path != SEARCH_PATH:
+            return self._send(404, "<html><body>Not found</body></html>")
+        
+        self._delay()
+        if not self._logged_in():
+            return self._redirect(LOGIN_PATH)
+        self._count("page_loads")
+        self._search_page()
+    
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        length = int(self.headers.get("Content-Length") or 0)
+        fields = {
+            name: values[0]
+            for name, values in parse_qs(self.rfile.read(length).decode("utf-8"), keep_blank_values=True).items()
+        }
+        
+        if path == LOGIN_PATH:
+            return self._redirect(SEARCH_PATH, [("Set-Cookie", f"{AUTH_COOKIE}=1; Path=/")])
+        if path != SEARCH_PATH:
+            return self._send(404, "<html><body>Not found</body></html>")
+        
+        self._delay()
+        if not self._logged_in():
+            return self._redirect(LOGIN_PATH)
+        
+        if fields.get("__EVENTTARGET") == "ctl00$cphMain$lbtnAbandon":
+            self._count("abandons")
+            return self._search_page()
+        
+        serial = fields.get("ctl00$cphMain$tbxSerialNo", "")
+        pin = fields.get("ctl00$cphMain$tbxPinNo", "")
+        self._count("lookups")
+        
+        # Injected failures
+        roll = self.config.chance()
+        if roll < self.config.error_rate:
+            self._count("injected_errors")
+            return self._send(500, "<html><body><h1>Server Error in '/' Application.</h1></body></html>")
+        if roll < self.config.error_rate + self.config.blank_rate:
+            self._count("injected_blank_pages")
+            return self._send(200, "<html><body><p>Please try again later.</p></body></html>")
+        
+        outcome = expected_outcome(serial, pin, self.config)
+        self._count(outcome)
+        if outcome == INVALID:
+            return self._search_page(ERROR_MESSAGE)
+        self._result_page(serial, outcome)
+
+def start_server(config=None, host="127.0.0.1", port=0, verbose=False):
+    """
+    Start the stand-in site on a background thread.
+    
+    Args:
+        config (MockSiteConfig): Site behaviour, defaults to MockSiteConfig()
+        host (str): Interface to listen on
+        port (int): Port to listen on, 0 for any free port
+        verbose (bool): Log every request
+    
+    Returns:
+        ThreadingHTTPServer: The running server; its search_url attribute is
+            the search page address and shutdown() stops it
+    """
+    server = ThreadingHTTPServer((host, port), MockAcorneHandler)
+    server.daemon_threads = True
+    server.config = config or MockSiteConfig()
+    server.verbose = verbose
+    server.stats = {}
+    server.stats_lock = threading.Lock()
+    server.viewstates = itertools.count(1)
+    server.search_url = f"http://{host}:{server.server_address[1]}{SEARCH_PATH}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def add_config_arguments(parser):
+    """Add the MockSiteConfig options to an argument parser."""
+    parser.add_argument("--success-rate", type=float, default=0.5,
+                        help="Share of vouchers that get the success page (default: 0.5)")
+    parser.add_argument("--claim-rate", type=float, default=0.2,
+                        help="Share of vouchers that get the claim page (default: 0.2)")
+    parser.add_argument("--latency-ms", type=float, default=0,
+                        help="Delay added to every response (default: 0)")
+    parser.add_argument("--jitter-ms", type=float, default=0,
+                        help="Random extra delay of up to this many ms (default: 0)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Share of lookups answered with HTTP 500 (default: 0)")
+    parser.add_argument("--blank-rate", type=float, default=0.0,
+                        help="Share of lookups answered with an unrecognised page (default: 0)")
+    parser.add_argument("--require-login", action="store_true",
+                        help="Redirect to a login page until logged in")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for latency and failure injection")
+
+def config_from_args(args):
+    return MockSiteConfig(args.success_rate, args.claim_rate, args.latency_ms, args.jitter_ms,
+                          args.error_rate, args.blank_rate, args.require_login, args.seed)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the Acorne SVS voucher search")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default: 8765)")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    add_config_arguments(parser)
+    args = parser.parse_args(argv)
+    
+    server = start_server(config_from_args(args), args.host, args.port, args.verbose)
+    print(f"Stand-in voucher search running at {server.search_url}")
+    print("Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
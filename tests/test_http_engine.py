@@ -0,0 +1,106 @@
+import json
+import os
+import sys
+import urllib.request
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_acorne_server import ABANDON_LINK, MockSiteConfig, start_server
+from voucher_automation_simple import (
+    OUTCOME_CLAIM_PAGE,
+    OUTCOME_GENERIC_ABANDON,
+    OUTCOME_INVALID,
+    OUTCOME_SUCCESS_PAGE,
+)
+from voucher_http_engine import HttpVoucherSession, SearchPage, process_voucher
+
+
+@pytest.fixture
+def site():
+    servers = []
+    
+    def start(**config):
+        server = start_server(MockSiteConfig(**config))
+        servers.append(server)
+        return server
+    
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def stats(server):
+    url = server.search_url.replace("/vouchers/search.aspx", "/stats")
+    with urllib.request.urlopen(url) as response:
+        return json.load(response)
+
+
+def look_up(server, serial="AAAA1111", pin="1111"):
+    session = HttpVoucherSession(server.search_url)
+    details = {}
+    try:
+        success = process_voucher(session, serial, pin, 5, details)
+        return success, details, session.page
+    finally:
+        session.quit()
+
+
+def test_invalid_serial_pin(site):
+    server = site(success_rate=0, claim_rate=0)
+    success, details, page = look_up(server)
+    assert success is False
+    assert details["outcome"] == OUTCOME_INVALID
+    assert stats(server).get("abandons") is None
+
+
+def test_valid_voucher_gets_the_claim_page_and_is_abandoned(site):
+    server = site(success_rate=0, claim_rate=1)
+    success, details, page = look_up(server)
+    assert success is False
+    assert details["outcome"] == OUTCOME_CLAIM_PAGE
+    assert stats(server)["abandons"] == 1
+
+
+def test_claimed_voucher_gets_the_success_page_and_is_abandoned(site):
+    server = site(success_rate=1)
+    success, details, page = look_up(server)
+    assert success is True
+    assert details["outcome"] == OUTCOME_SUCCESS_PAGE
+    assert stats(server)["abandons"] == 1
+
+
+def test_abandon_returns_to_the_search_form_with_a_fresh_viewstate(site):
+    server = site(success_rate=1)
+    session = HttpVoucherSession(server.search_url)
+    try:
+        assert process_voucher(session, "AAAA1111", "1111", 5, {}) is True
+        # The Abandon postback's response is the form the next lookup posts
+        assert session.page.is_search_form()
+        viewstate = session.page.form_fields()["__VIEWSTATE"]
+        assert process_voucher(session, "BBBB2222", "2222", 5, {}) is True
+        assert session.page.form_fields()["__VIEWSTATE"] != viewstate
+    finally:
+        session.quit()
+    counts = stats(server)
+    assert counts["lookups"] == 2
+    assert counts["abandons"] == 2
+    assert counts["page_loads"] == 1
+
+
+def test_unrecognised_page(site):
+    server = site(blank_rate=1)
+    success, details, page = look_up(server)
+    assert success is False
+    assert details["outcome"] is None
+    assert page.is_search_form()
+
+
+def test_generic_abandon_link():
+    page = SearchPage("http://127.0.0.1/vouchers/search.aspx",
+                      f"<html><body><form action='./search.aspx'><p>{ABANDON_LINK}</p></form></body></html>")
+    state, link = page.classify()
+    assert state == OUTCOME_GENERIC_ABANDON
+    assert link.attrs["id"] == "ctl00_cphMain_lbtnAbandon"
@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from voucher_automation_simple import ResultJournal, plan_rows, read_journal, result_text
+
+
+def test_resume_twice_from_torn_journal(tmp_path):
+    path = str(tmp_path / "vouchers_journal.jsonl")
+    journal = ResultJournal(path)
+    journal.open("vouchers.csv")
+    journal.record(8, "1111", "2222", "Claimed", "claimed", 1.0)
+    journal.close()
+    
+    # A crash mid-write leaves part of a record on the last line
+    with open(path, 'a', encoding='utf-8') as file:
+        file.write('{"row": 9, "ser')
+    
+    journal = ResultJournal(path)
+    assert set(journal.open("vouchers.csv", resume=True)) == {8}
+    journal.record(7, "3333", "4444", "Error", "invalid", 1.0)
+    journal.close()
+    
+    journal = ResultJournal(path)
+    finished = journal.open("vouchers.csv", resume=True)
+    journal.close()
+    assert set(finished) == {7, 8}
+    assert finished[7]["result"] == "Error"
+    assert read_journal(path) == finished
+
+
+def test_resume_looks_up_dead_letters_again(tmp_path):
+    path = str(tmp_path / "vouchers_journal.jsonl")
+    journal = ResultJournal(path)
+    journal.open("vouchers.csv")
+    journal.record(0, "AAAA1111", "1111", "Claimed", "success_page", 1.0)
+    journal.record(1, "BBBB2222", "2222", result_text(False, {"dead_letter": True, "attempts": 3}), None, 12.0)
+    journal.close()
+    
+    journal = ResultJournal(path)
+    records = journal.open("vouchers.csv", resume=True)
+    journal.close()
+    rows = [{"Info": "Virgin AAAA1111 1111"}, {"Info": "Virgin BBBB2222 2222"}]
+    planned = [item[4] for item in plan_rows(rows, records, quiet=True)]
+    assert planned == ["Claimed", None]
+
+
+def test_records_are_synced_while_the_run_stalls(tmp_path):
+    path = str(tmp_path / "vouchers_journal.jsonl")
+    journal = ResultJournal(path, sync_every=20, sync_interval=0.2)
+    journal.open("vouchers.csv")
+    journal.record(0, "AAAA1111", "1111", "Claimed", "success_page", 1.0)
+    try:
+        # No further record arrives to trigger the sync
+        time.sleep(0.5)
+        with journal._lock:
+            assert journal._unsynced == 0
+        assert set(read_journal(path)) == {0}
+    finally:
+        journal.close()
@@ -0,0 +1,47 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from voucher_automation_simple import AdaptiveThrottle
+
+
+def finish_lookup(throttle, latency, healthy, outcome=None):
+    throttle.in_flight += 1
+    throttle.release(latency, healthy, outcome)
+
+
+def test_recovers_quickly_after_a_burst_of_failures():
+    throttle = AdaptiveThrottle(min_delay=0.25, max_delay=30.0)
+    for _ in range(8):
+        # Failures further apart than a typical lookup each count as a back-off
+        throttle.last_backoff = float("-inf")
+        finish_lookup(throttle, 12.0, False)
+    assert throttle.delay == 30.0
+    
+    waited = 0.0
+    lookups = 0
+    while throttle.delay > throttle.min_delay:
+        waited += throttle.delay
+        finish_lookup(throttle, 0.5, True, "invalid")
+        lookups += 1
+    assert lookups < 60
+    assert waited < 120
+
+
+def test_backs_off_from_no_gap_at_all():
+    throttle = AdaptiveThrottle(min_delay=0.0, start_delay=0.0)
+    finish_lookup(throttle, 0.5, True, "invalid")
+    assert throttle.delay == 0.0
+    finish_lookup(throttle, 12.0, False)
+    assert throttle.delay == throttle.backoff_floor
+
+
+def test_gap_is_shared_across_the_window():
+    throttle = AdaptiveThrottle(min_delay=0.2, start_delay=0.2, max_window=4)
+    started = time.monotonic()
+    for _ in range(4):
+        throttle.acquire()
+    # Four slots start a lookup every 0.05s between them, not every 0.2s
+    assert time.monotonic() - started < 0.3
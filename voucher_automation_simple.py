@@ -1,13 +1,70 @@
+import argparse
+import array
+import codecs
+import collections
+import contextlib
 import csv
+import heapq
+import importlib.util
+import queue
+import random
 import re
+import sqlite3
+import sys
+import threading
 import time
 import os
 import datetime
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
+import functools
+import glob
+import itertools
+import json
+import zlib
+# Selenium is imported in the functions that drive Chrome, so commands that
+# never open a browser (preview, report, --merge) start without loading it
+
+SEARCH_URL = "https://www.acornesvs.co.uk/vouchers/search.aspx"
+
+# Elements that identify each page state after a lookup
+ERROR_MESSAGE_XPATH = "/html/body/div[1]/form/div[5]/div[1]/div[1]/div"
+CLAIM_BUTTON_XPATH = "/html/body/div[1]/form/div[5]/div/div[2]/fieldset/table/tbody/tr[13]/td[1]/input"
+CLAIM_ABANDON_XPATH = "/html/body/div[1]/form/div[5]/div/div[2]/fieldset/table/tbody/tr[13]/td[1]/a"
+SUCCESS_ABANDON_XPATH = "/html/body/div[1]/form/div[5]/div/div[2]/fieldset/table/tbody/tr[12]/td[1]/a"
+GENERIC_ABANDON_XPATH = "//a[contains(text(), 'Abandon')]"
+
+# Page states recognised by classify_outcome
+OUTCOME_INVALID = "invalid"
+OUTCOME_CLAIM_PAGE = "claim_page"
+OUTCOME_SUCCESS_PAGE = "success_page"
+OUTCOME_GENERIC_ABANDON = "generic_abandon"
+
+# What a finished lookup means for the row, worked out by lookup_kind
+LOOKUP_CLAIMED = "claimed"
+LOOKUP_REJECTED = "rejected"    # the site answered, and the voucher wasn't claimed
+LOOKUP_TRANSIENT = "transient"  # no answer (timeout, unrecognised page, browser error), worth retrying
+
+# Start of the Result of a row that never got an answer, which --resume looks up again
+DEAD_LETTER_RESULT = "Error - No answer from the site"
+
+# Overall deadline (seconds) for a result page to appear after a lookup
+OUTCOME_TIMEOUT = 12
+
+# Seconds to wait for a specific page before settling for a generic abandon link
+GENERIC_ABANDON_GRACE = 1
+
+# Patterns used by extract_serial_pin, compiled once
+# Pattern looks for:
+# - Optional "Virgin" or "Virgin Exp" or "VirginEXP" prefix (case insensitive)
+# - Serial number: 7-9 characters (letters and numbers)
+# - Followed by space(s) or other separators
+# - PIN: 4 characters (letters and numbers)
+# The prefix is written as (?:virgin\s*(?:exp)?)? rather than the older
+# (?:virgin\s*(?:exp|)|)?, which matched the same text but retried every
+# failing position twice.
+SERIAL_PIN_PATTERN = re.compile(r'(?:virgin\s*(?:exp)?)?\s*([a-z0-9]{7,9})\s*(?:pin\s*)?([a-z0-9]{4})', re.IGNORECASE)
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+', re.IGNORECASE)
+CORRECTED_SERIAL_PATTERN = re.compile(r'correct SN:\s*([a-z0-9]{7,9})', re.IGNORECASE)
+CORRECTED_PIN_PATTERN = re.compile(r'correct PIN:\s*([a-z0-9]{4})', re.IGNORECASE)
 
 def extract_serial_pin(info_text):
     """
@@ -25,577 +82,3623 @@ def extract_serial_pin(info_text):
         
     info_text = info_text.strip()
     
-    # Try to extract serial and PIN using regex
-    # Pattern looks for:
-    # - Optional "Virgin" or "Virgin Exp" or "VirginEXP" prefix (case insensitive)
-    # - Serial number: 7-9 characters (letters and numbers)
-    # - Followed by space(s) or other separators
-    # - PIN: 4 characters (letters and numbers)
-    pattern = r'(?:virgin\s*(?:exp|)|)?\s*([a-z0-9]{7,9})\s*(?:pin\s*)?([a-z0-9]{4})'
-    match = re.search(pattern, info_text, re.IGNORECASE)
-    
+    # Try to extract serial and PIN using the main pattern
+    match = SERIAL_PIN_PATTERN.search(info_text)
     if match:
-        serial = match.group(1)
-        pin = match.group(2)
-        return serial, pin
+        return match.group(1), match.group(2)
+    
+    # Every fallback rule works from one tokenisation of the cell
+    words = TOKEN_PATTERN.findall(info_text)
     
-    # If the standard pattern doesn't match, try a more flexible approach
     # Look for any sequence of 7-9 alphanumeric characters followed by 4 alphanumeric characters
-    words = re.findall(r'[a-z0-9]+', info_text, re.IGNORECASE)
     for i in range(len(words) - 1):
         if 7 <= len(words[i]) <= 9 and len(words[i+1]) == 4:
             return words[i], words[i+1]
     
-    # If we still can't find a match, check for any corrections in the text
+    # Check for any corrections in the text. The marker check is
+    # case-sensitive (unlike the patterns) to keep results unchanged.
     if "correct SN:" in info_text:
-        # Extract the corrected serial number
-        corrected_sn_match = re.search(r'correct SN:\s*([a-z0-9]{7,9})', info_text, re.IGNORECASE)
+        corrected_sn_match = CORRECTED_SERIAL_PATTERN.search(info_text)
         if corrected_sn_match:
-            corrected_sn = corrected_sn_match.group(1)
-            # Try to find the PIN in the original text
-            pin_match = re.search(r'([a-z0-9]{4})', info_text, re.IGNORECASE)
-            if pin_match:
-                return corrected_sn, pin_match.group(1)
+            # The PIN is the first run of 4 alphanumeric characters anywhere in the text
+            for word in words:
+                if len(word) >= 4:
+                    return corrected_sn_match.group(1), word[:4]
     
-    # If we still can't find a match, check for any corrections in the text for PIN
     if "correct PIN:" in info_text:
-        # Extract the corrected PIN
-        corrected_pin_match = re.search(r'correct PIN:\s*([a-z0-9]{4})', info_text, re.IGNORECASE)
+        corrected_pin_match = CORRECTED_PIN_PATTERN.search(info_text)
         if corrected_pin_match:
-            corrected_pin = corrected_pin_match.group(1)
-            # Try to find the serial in the original text
-            serial_match = re.search(r'([a-z0-9]{7,9})', info_text, re.IGNORECASE)
-            if serial_match:
-                return serial_match.group(1), corrected_pin
+            # The serial is the first run of 7-9 alphanumeric characters anywhere in the text
+            for word in words:
+                if len(word) >= 7:
+                    return word[:9], corrected_pin_match.group(1)
     
     # If all attempts fail, return None for both
     return None, None
 
-def process_voucher(driver, serial, pin):
+def extract_serial_pin_batch(info_texts):
     """
-    Process a single voucher by inputting serial and PIN, clicking search,
-    and handling the resulting page.
+    Extract serial numbers and PINs from a whole column of cells.
+    
+    Cells are rarely repeated within a sheet, so each is simply parsed in
+    turn; caching them cost more than it saved.
+    
+    Args:
+        info_texts (iterable): Cell texts, as passed to extract_serial_pin
+        
+    Returns:
+        list: (serial_number, pin) tuples in the same order as the cells
+    """
+    return list(map(extract_serial_pin, info_texts))
+
+def classify_outcome(driver, ignored_elements=(), timeout=OUTCOME_TIMEOUT):
+    """
+    Wait for the page that follows a lookup and work out which state it is in.
+    
+    Every known page state is checked on each poll, so this returns as soon
+    as any of them appears rather than waiting on each state in turn.
+    
+    Args:
+        driver (WebDriver): Selenium WebDriver instance
+        ignored_elements (set): IDs of elements that were already on the page
+            before the lookup (e.g. the previous voucher's error message)
+        timeout (float): Overall deadline in seconds
+        
+    Returns:
+        tuple: (state, element) where state is one of the OUTCOME_* constants
+            and element is the matching element, or (None, None) on timeout
+    """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.common.exceptions import (
+        TimeoutException, NoSuchElementException, StaleElementReferenceException
+    )
+    
+    started = time.time()
+    
+    def match_state(driver):
+        # Invalid serial/PIN: the error message div on the search page
+        error_messages = driver.find_elements(By.XPATH, ERROR_MESSAGE_XPATH)
+        if error_messages and error_messages[0].id not in ignored_elements:
+            if "error msg-block" in (error_messages[0].get_attribute("class") or ""):
+                return OUTCOME_INVALID, error_messages[0]
+        
+        # Claim page: a button next to the abandon link
+        if driver.find_elements(By.XPATH, CLAIM_BUTTON_XPATH):
+            abandon_buttons = driver.find_elements(By.XPATH, CLAIM_ABANDON_XPATH)
+            if abandon_buttons:
+                return OUTCOME_CLAIM_PAGE, abandon_buttons[0]
+        
+        # Success page: only the abandon link is present
+        abandon_buttons = driver.find_elements(By.XPATH, SUCCESS_ABANDON_XPATH)
+        if abandon_buttons:
+            return OUTCOME_SUCCESS_PAGE, abandon_buttons[0]
+        
+        # Any other abandon link only counts once the specific pages have had
+        # a moment to render, so a half-loaded page isn't misclassified
+        if time.time() - started >= GENERIC_ABANDON_GRACE:
+            abandon_buttons = [
+                button for button in driver.find_elements(By.XPATH, GENERIC_ABANDON_XPATH)
+                if button.id not in ignored_elements
+            ]
+            if abandon_buttons:
+                return OUTCOME_GENERIC_ABANDON, abandon_buttons[0]
+        
+        return False
+    
+    try:
+        return WebDriverWait(
+            driver, timeout, poll_frequency=0.05,
+            ignored_exceptions=(NoSuchElementException, StaleElementReferenceException)
+        ).until(match_state)
+    except TimeoutException:
+        return None, None
+
+# Fills in the serial and PIN and presses Lookup in a single WebDriver call.
+# Leftovers from the previous voucher (error message, Abandon links) are
+# tagged first so the outcome script can tell them apart from this voucher's
+# result. The click runs after the script has returned, so the postback
+# doesn't race the reply. Returns false while the search form isn't loaded.
+SUBMIT_SCRIPT = """
+var serialInput = document.getElementById('ctl00_cphMain_tbxSerialNo');
+var pinInput = document.getElementById('ctl00_cphMain_tbxPinNo');
+var lookupButton = document.getElementById('ctl00_cphMain_btnLookup');
+if (!serialInput || !pinInput || !lookupButton) {
+    return false;
+}
+for (var i = 2; i < arguments.length; i++) {
+    var leftovers = document.evaluate(arguments[i], document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    for (var j = 0; j < leftovers.snapshotLength; j++) {
+        leftovers.snapshotItem(j).setAttribute('data-voucher-stale', '1');
+    }
+}
+serialInput.value = arguments[0];
+pinInput.value = arguments[1];
+setTimeout(function () { lookupButton.click(); }, 0);
+return true;
+"""
+
+# Reads every outcome marker in a single WebDriver call, in the same order
+# and with the same rules as classify_outcome. Returns [index, element] with
+# the index into SCRIPT_OUTCOMES, or null if no result page is showing yet.
+OUTCOME_SCRIPT = """
+function first(xpath) {
+    return document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+}
+var errorMessage = first(arguments[0]);
+if (errorMessage && !errorMessage.hasAttribute('data-voucher-stale')
+        && (errorMessage.getAttribute('class') || '').indexOf('error msg-block') !== -1) {
+    return [0, errorMessage];
+}
+if (first(arguments[1])) {
+    var claimAbandon = first(arguments[2]);
+    if (claimAbandon) {
+        return [1, claimAbandon];
+    }
+}
+var successAbandon = first(arguments[3]);
+if (successAbandon) {
+    return [2, successAbandon];
+}
+if (arguments[5]) {
+    var links = document.evaluate(arguments[4], document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    for (var i = 0; i < links.snapshotLength; i++) {
+        if (!links.snapshotItem(i).hasAttribute('data-voucher-stale')) {
+            return [3, links.snapshotItem(i)];
+        }
+    }
+}
+return null;
+"""
+
+SCRIPT_OUTCOMES = (OUTCOME_INVALID, OUTCOME_CLAIM_PAGE, OUTCOME_SUCCESS_PAGE, OUTCOME_GENERIC_ABANDON)
+
+def submit_by_script(driver, serial, pin, timeout=10):
+    """
+    Fill in and submit the search form with one injected script.
     
     Args:
         driver (WebDriver): Selenium WebDriver instance
         serial (str): Serial number to input
         pin (str): PIN to input
+        timeout (float): Seconds to wait for the search form
         
     Returns:
-        bool: True if voucher was successfully claimed, False otherwise
+        bool: True once the lookup has been submitted, False if scripts
+            can't be run on the page (the caller should use the elements)
     """
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.common.exceptions import JavascriptException
+    
     try:
-        # Wait for the page to be ready
-        WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.ID, "ctl00_cphMain_tbxSerialNo"))
+        return WebDriverWait(driver, timeout, poll_frequency=0.05).until(
+            lambda driver: driver.execute_script(SUBMIT_SCRIPT, serial, pin, ERROR_MESSAGE_XPATH, GENERIC_ABANDON_XPATH)
         )
+    except JavascriptException as e:
+        print(f"Script submit unavailable, using the form elements: {e.msg}")
+        return False
+
+def classify_outcome_by_script(driver, timeout=OUTCOME_TIMEOUT):
+    """
+    Like classify_outcome, but checks every page state with one script call
+    per poll instead of several element lookups. Leftovers from the previous
+    voucher were tagged by SUBMIT_SCRIPT, so nothing needs to be passed in.
+    
+    Args:
+        driver (WebDriver): Selenium WebDriver instance
+        timeout (float): Overall deadline in seconds
         
-        # Clear and input serial number
-        serial_input = driver.find_element(By.ID, "ctl00_cphMain_tbxSerialNo")
-        serial_input.clear()
-        serial_input.send_keys(serial)
-        
-        # Clear and input PIN
-        pin_input = driver.find_element(By.ID, "ctl00_cphMain_tbxPinNo")
-        pin_input.clear()
-        pin_input.send_keys(pin)
+    Returns:
+        tuple: (state, element) as for classify_outcome
+    """
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.common.exceptions import (
+        TimeoutException, NoSuchElementException, StaleElementReferenceException, JavascriptException
+    )
+    
+    started = time.time()
+    
+    def match_state(driver):
+        allow_generic = time.time() - started >= GENERIC_ABANDON_GRACE
+        found = driver.execute_script(
+            OUTCOME_SCRIPT, ERROR_MESSAGE_XPATH, CLAIM_BUTTON_XPATH, CLAIM_ABANDON_XPATH,
+            SUCCESS_ABANDON_XPATH, GENERIC_ABANDON_XPATH, allow_generic
+        )
+        if not found:
+            return False
+        return SCRIPT_OUTCOMES[found[0]], found[1]
+    
+    try:
+        return WebDriverWait(
+            driver, timeout, poll_frequency=0.05,
+            ignored_exceptions=(NoSuchElementException, StaleElementReferenceException, JavascriptException)
+        ).until(match_state)
+    except TimeoutException:
+        return None, None
+
+@contextlib.contextmanager
+def phase_span(details, phase):
+    """
+    Time one phase of a lookup, adding the seconds to details['phases'][phase].
+    
+    Args:
+        details (dict): Per-lookup details dict passed to process_voucher
+        phase (str): Name of the phase, e.g. 'fill' or 'abandon'
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases = details.setdefault('phases', {})
+        phases[phase] = phases.get(phase, 0.0) + time.perf_counter() - started
+
+def process_voucher(driver, serial, pin, outcome_timeout=OUTCOME_TIMEOUT, details=None, script_submit=True):
+    """
+    Process a single voucher by inputting serial and PIN, clicking search,
+    and handling the resulting page.
+    
+    By default the form is filled in and submitted, and the result page read,
+    with injected scripts (one WebDriver call each) rather than one call per
+    element action. If scripts can't run, the form elements are used.
+    
+    Args:
+        driver (WebDriver): Selenium WebDriver instance
+        serial (str): Serial number to input
+        pin (str): PIN to input
+        outcome_timeout (float): Seconds to wait for the result page
+        details (dict): Optional dict that receives the matched page state
+            ('outcome'), how long it took to appear ('outcome_wait'), the
+            seconds spent in each phase ('phases'), the type of any
+            exception that ended the lookup ('exception') and whether it was
+            submitted by 'script' or 'elements' ('submit_path')
+        script_submit (bool): Try the single-call script path first
         
-        # Click search button
-        search_button = driver.find_element(By.ID, "ctl00_cphMain_btnLookup")
-        search_button.click()
+    Returns:
+        bool: True if voucher was successfully claimed, False otherwise
+    """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    
+    if details is None:
+        details = {}
+    details['outcome'] = None
+    
+    try:
+        submitted = False
+        if script_submit:
+            with phase_span(details, 'submit'):
+                submitted = submit_by_script(driver, serial, pin)
         
-        # Wait for the page to load
-        time.sleep(2)
+        if submitted:
+            details['submit_path'] = 'script'
+            started = time.time()
+            with phase_span(details, 'outcome'):
+                state, element = classify_outcome_by_script(driver, outcome_timeout)
+            details['outcome'] = state
+            details['outcome_wait'] = time.time() - started
+        else:
+            details['submit_path'] = 'elements'
+            state, element = _submit_by_elements(driver, serial, pin, outcome_timeout, details)
         
-        # First, check for error message on the same page (invalid serial/PIN)
-        try:
-            # Look for the error message div
-            error_message_xpath = "/html/body/div[1]/form/div[5]/div[1]/div[1]/div"
-            error_message = driver.find_elements(By.XPATH, error_message_xpath)
+        if state == OUTCOME_INVALID:
+            print(f"Error message detected for {serial} {pin}: Invalid serial/PIN")
             
-            if error_message and "error msg-block" in error_message[0].get_attribute("class"):
-                print(f"Error message detected for {serial} {pin}: Invalid serial/PIN")
-                
-                # Clear the input fields for the next voucher
-                serial_input = driver.find_element(By.ID, "ctl00_cphMain_tbxSerialNo")
-                serial_input.clear()
-                
-                pin_input = driver.find_element(By.ID, "ctl00_cphMain_tbxPinNo")
-                pin_input.clear()
-                
-                return False  # Error case
-        except (TimeoutException, NoSuchElementException):
-            # No error message found, continue with other checks
-            pass
+            # Clear the input fields for the next voucher (the script path
+            # overwrites them anyway, so only the element path needs this)
+            if not submitted:
+                with phase_span(details, 'clear'):
+                    serial_input = driver.find_element(By.ID, "ctl00_cphMain_tbxSerialNo")
+                    serial_input.clear()
+                    
+                    pin_input = driver.find_element(By.ID, "ctl00_cphMain_tbxPinNo")
+                    pin_input.clear()
+            
+            return False  # Error case
         
-        # Check which page we're on by looking for specific elements
-        try:
-            # Check if we're on the claim page (error page)
-            # This is the page where a button is found at the specified XPath
-            error_button_xpath = "/html/body/div[1]/form/div[5]/div/div[2]/fieldset/table/tbody/tr[13]/td[1]/input"
-            WebDriverWait(driver, 5).until(
-                EC.presence_of_element_located((By.XPATH, error_button_xpath))
-            )
+        if state is None:
+            print(f"No result page recognised for {serial} {pin} after {outcome_timeout}s")
+            # Try to navigate back to the search page
+            with phase_span(details, 'reset'):
+                driver.get(SEARCH_URL)
+            return False
+        
+        if state == OUTCOME_CLAIM_PAGE:
             print(f"Error page detected for {serial} {pin}")
-            
+        elif state == OUTCOME_SUCCESS_PAGE:
+            print(f"Success page detected for {serial} {pin}")
+        else:
+            print(f"Found generic abandon button for {serial} {pin}")
+        
+        with phase_span(details, 'abandon'):
             # Click the abandon button
-            abandon_button_xpath = "/html/body/div[1]/form/div[5]/div/div[2]/fieldset/table/tbody/tr[13]/td[1]/a"
-            abandon_button = driver.find_element(By.XPATH, abandon_button_xpath)
-            abandon_button.click()
+            element.click()
             
             # Wait for navigation back to main page
             WebDriverWait(driver, 10).until(
                 EC.presence_of_element_located((By.ID, "ctl00_cphMain_tbxSerialNo"))
             )
-            
-            return False  # Error case
-            
-        except (TimeoutException, NoSuchElementException):
-            try:
-                # Check if we're on the correct page (success page)
-                # This is the page where only the abandon button is present
-                success_button_xpath = "/html/body/div[1]/form/div[5]/div/div[2]/fieldset/table/tbody/tr[12]/td[1]/a"
-                WebDriverWait(driver, 5).until(
-                    EC.presence_of_element_located((By.XPATH, success_button_xpath))
-                )
-                print(f"Success page detected for {serial} {pin}")
-                
-                # Click the abandon button
-                abandon_button = driver.find_element(By.XPATH, success_button_xpath)
-                abandon_button.click()
-                
-                # Wait for navigation back to main page
-                WebDriverWait(driver, 10).until(
-                    EC.presence_of_element_located((By.ID, "ctl00_cphMain_tbxSerialNo"))
-                )
-                
-                return True  # Success case
-                
-            except (TimeoutException, NoSuchElementException):
-                # If we can't determine the page, try a more generic approach
-                try:
-                    # Look for any abandon button
-                    abandon_buttons = driver.find_elements(By.XPATH, "//a[contains(text(), 'Abandon')]")
-                    if abandon_buttons:
-                        print(f"Found generic abandon button for {serial} {pin}")
-                        abandon_buttons[0].click()
-                        
-                        # Wait for navigation back to main page
-                        WebDriverWait(driver, 10).until(
-                            EC.presence_of_element_located((By.ID, "ctl00_cphMain_tbxSerialNo"))
-                        )
-                        
-                        # Assume error since we couldn't determine specifically
-                        return False
-                    else:
-                        print(f"No abandon button found for {serial} {pin}")
-                        # Try to navigate back to the search page
-                        driver.get("https://www.acornesvs.co.uk/vouchers/search.aspx")
-                        return False
-                except Exception as e:
-                    print(f"Error finding abandon button: {str(e)}")
-                    # Try to navigate back to the search page
-                    driver.get("https://www.acornesvs.co.uk/vouchers/search.aspx")
-                    return False
+        
+        # Only the success page counts as claimed; the generic case is
+        # assumed to be an error since we couldn't determine specifically
+        return state == OUTCOME_SUCCESS_PAGE
     except Exception as e:
         print(f"Error processing voucher {serial} {pin}: {str(e)}")
+        details['exception'] = type(e).__name__
         # Try to navigate back to the search page
         try:
-            driver.get("https://www.acornesvs.co.uk/vouchers/search.aspx")
+            with phase_span(details, 'reset'):
+                driver.get(SEARCH_URL)
         except:
             pass
         return False
 
-def read_csv_file(file_path):
+def _submit_by_elements(driver, serial, pin, outcome_timeout, details):
     """
-    Read the CSV file and return the data as a list of dictionaries.
+    Fill in and submit the search form one element action at a time, and
+    wait for the result page.
+    
+    Returns:
+        tuple: (state, element) as for classify_outcome
+    """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    
+    # Wait for the page to be ready
+    with phase_span(details, 'page_ready'):
+        WebDriverWait(driver, 10).until(
+            EC.presence_of_element_located((By.ID, "ctl00_cphMain_tbxSerialNo"))
+        )
+        
+        # Remember anything left over from the previous voucher so it isn't
+        # mistaken for this voucher's result
+        ignored_elements = {
+            element.id for element in
+            driver.find_elements(By.XPATH, ERROR_MESSAGE_XPATH) + driver.find_elements(By.XPATH, GENERIC_ABANDON_XPATH)
+        }
+    
+    with phase_span(details, 'fill'):
+        # Clear and input serial number
+        serial_input = driver.find_element(By.ID, "ctl00_cphMain_tbxSerialNo")
+        serial_input.clear()
+        serial_input.send_keys(serial)
+        
+        # Clear and input PIN
+        pin_input = driver.find_element(By.ID, "ctl00_cphMain_tbxPinNo")
+        pin_input.clear()
+        pin_input.send_keys(pin)
+    
+    # Click search button
+    with phase_span(details, 'submit'):
+        search_button = driver.find_element(By.ID, "ctl00_cphMain_btnLookup")
+        search_button.click()
+    
+    # Wait for whichever result page appears first
+    started = time.time()
+    with phase_span(details, 'outcome'):
+        state, element = classify_outcome(driver, ignored_elements, outcome_timeout)
+    details['outcome'] = state
+    details['outcome_wait'] = time.time() - started
+    return state, element
+
+# Bytes read from the start of a CSV file to work out its encoding and layout
+SNIFF_BYTES = 64 * 1024
+
+def _decode_as_latin1(error):
+    """Codec error handler that decodes any invalid bytes as latin-1."""
+    return error.object[error.start:error.end].decode('latin-1'), error.end
+
+codecs.register_error('latin1fallback', _decode_as_latin1)
+
+def sniff_csv_format(file_path):
+    """
+    Work out the encoding and CSV dialect of a file from its first few kilobytes.
     
     Args:
         file_path (str): Path to the CSV file
         
     Returns:
-        list: List of dictionaries representing rows in the CSV
+        tuple: (encoding, dialect) where encoding is 'utf-8-sig', 'utf-16',
+            'utf-8' or 'latin-1' and dialect is a csv.Dialect
+    """
+    with open(file_path, 'rb') as file:
+        prefix = file.read(SNIFF_BYTES)
+    
+    if prefix.startswith(codecs.BOM_UTF8):
+        encoding = 'utf-8-sig'
+    elif prefix.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        # Excel's "Unicode Text" export
+        encoding = 'utf-16'
+    else:
+        try:
+            # Not final, so a character cut off at the end of the prefix is fine
+            codecs.getincrementaldecoder('utf-8')().decode(prefix, final=False)
+            encoding = 'utf-8'
+        except UnicodeDecodeError:
+            encoding = 'latin-1'
+    
+    # Only sniff whole lines
+    sample = codecs.getincrementaldecoder(encoding)(errors='replace').decode(prefix)
+    if len(prefix) == SNIFF_BYTES and '\n' in sample:
+        sample = sample[:sample.rindex('\n') + 1]
+    # Only the delimiter is sniffed; Excel's quoting is kept, since a guessed
+    # quotechar of ' would eat the apostrophes in names and typed-as-text cells
+    try:
+        delimiter = csv.Sniffer().sniff(sample, delimiters=',;\t|').delimiter
+    except csv.Error:
+        delimiter = ','
+    dialect = type('SniffedDialect', (csv.excel,), {'delimiter': delimiter})
+    
+    return encoding, dialect
+
+def iter_csv_rows(file_path, quiet=False):
+    """
+    Read the CSV file one row at a time.
+    
+    The encoding and dialect are sniffed from the start of the file and the
+    rows are then parsed in a single buffered pass. If a UTF-8 file turns out
+    to contain a stray non-UTF-8 byte further on, that byte is read as latin-1
+    rather than starting over.
+    
+    Args:
+        file_path (str): Path to the CSV file
+        quiet (bool): Don't report the detected format
+        
+    Yields:
+        dict: One row of the CSV, keyed by the header row
     """
     # Remove any quotes from the file path
     file_path = file_path.strip('"\'')
     
-    data = []
-    try:
-        with open(file_path, 'r', encoding='utf-8-sig') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                data.append(row)
-        return data
-    except Exception as e:
-        print(f"Error reading CSV file: {str(e)}")
-        # Try with different encodings if utf-8-sig fails
-        try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    data.append(row)
-            return data
-        except Exception as e2:
-            print(f"Also tried with utf-8 encoding: {str(e2)}")
-            try:
-                with open(file_path, 'r', encoding='latin-1') as file:
-                    reader = csv.DictReader(file)
-                    for row in reader:
-                        data.append(row)
-                return data
-            except Exception as e3:
-                print(f"Also tried with latin-1 encoding: {str(e3)}")
-                return []
+    encoding, dialect = sniff_csv_format(file_path)
+    if not quiet:
+        print(f"Detected encoding {encoding} with {dialect.delimiter!r} delimiter")
+    
+    with open(file_path, 'r', encoding=encoding, errors='latin1fallback',
+              newline='', buffering=1024 * 1024) as file:
+        for row in csv.DictReader(file, dialect=dialect):
+            yield row
 
-def write_results_csv(input_file, results):
+EXCEL_EXTENSIONS = (".xlsx", ".xlsm")
+INPUT_EXTENSIONS = (".csv",) + EXCEL_EXTENSIONS
+
+def _cell_text(value):
+    """Turn an Excel cell value into the text a CSV export of it would hold."""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float) and value.is_integer():
+        # Serial numbers typed as numbers come back as floats
+        return str(int(value))
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%d/%m/%Y" if value.time() == datetime.time() else "%d/%m/%Y %H:%M")
+    if isinstance(value, datetime.date):
+        return value.strftime("%d/%m/%Y")
+    return str(value)
+
+def iter_xlsx_rows(file_path, sheet=None, quiet=False):
     """
-    Write the results to a new CSV file.
+    Read an Excel workbook one row at a time.
+    
+    The workbook is opened read-only, so rows are parsed from the file as
+    they are asked for and memory stays at about one row whatever the size
+    of the workbook. The first row is the header, and cells are turned into
+    the text a CSV export would hold, so the rows look exactly like those
+    from iter_csv_rows.
     
     Args:
-        input_file (str): Path to the input CSV file
-        results (list): List of dictionaries with results
+        file_path (str): Path to the .xlsx file
+        sheet (str): Worksheet name, or its number counted from 1; defaults
+            to the sheet that was open when the workbook was saved
+        quiet (bool): Don't report which sheet is read
         
-    Returns:
-        str: Path to the output CSV file
+    Yields:
+        dict: One row of the sheet, keyed by the header row
     """
     try:
-        # Clean up the input file path - remove quotes and normalize
-        input_file = input_file.strip('"\'')
+        import openpyxl
+    except ImportError:
+        raise RuntimeError("Reading .xlsx files needs openpyxl (pip install openpyxl); "
+                           "or export the sheet to CSV")
+    
+    # Remove any quotes from the file path
+    file_path = file_path.strip('"\'')
+    
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        if sheet is None:
+            worksheet = workbook.active or workbook.worksheets[0]
+        elif sheet in workbook.sheetnames:
+            worksheet = workbook[sheet]
+        elif sheet.isdigit() and 1 <= int(sheet) <= len(workbook.worksheets):
+            worksheet = workbook.worksheets[int(sheet) - 1]
+        else:
+            raise ValueError(f"There is no sheet {sheet!r} in {os.path.basename(file_path)}; "
+                             f"it has {', '.join(repr(name) for name in workbook.sheetnames)}")
+        if not quiet:
+            print(f"Reading sheet {worksheet.title!r} of {os.path.basename(file_path)}")
         
-        # Get just the filename without the path
-        input_filename = os.path.basename(input_file)
+        rows = worksheet.iter_rows(values_only=True)
+        header = [_cell_text(name) for name in next(rows, ())]
+        # Formatted but empty columns at the right aren't part of the data
+        while header and not header[-1]:
+            header.pop()
+        if not header:
+            return
         
-        # Generate output file name in the current directory
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_filename = os.path.splitext(input_filename)[0] + f"_results_{timestamp}.csv"
-        output_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), output_filename)
+        for values in rows:
+            cells = [_cell_text(value) for value in values[:len(header)]]
+            cells += [""] * (len(header) - len(cells))
+            yield dict(zip(header, cells))
+    finally:
+        workbook.close()
+
+def iter_input_rows(file_path, sheet=None, quiet=False):
+    """
+    Read a spreadsheet one row at a time, from a CSV file or an Excel workbook.
+    
+    Args:
+        file_path (str): Path to the .csv, .xlsx or .xlsm file
+        sheet (str): Worksheet to read from a workbook (see iter_xlsx_rows)
+        quiet (bool): Don't report the format or sheet being read
         
-        print(f"Preparing to write results to: {output_file}")
+    Returns:
+        iterator: dict per row, keyed by the header row
+    """
+    if os.path.splitext(file_path.strip('"\''))[1].lower() in EXCEL_EXTENSIONS:
+        return iter_xlsx_rows(file_path, sheet, quiet)
+    return iter_csv_rows(file_path, quiet)
+
+def read_csv_file(file_path):
+    """
+    Read the CSV file and return the data as a list of dictionaries.
+    
+    Args:
+        file_path (str): Path to the CSV file
         
-        with open(output_file, 'w', newline='', encoding='utf-8') as file:
-            # Get all field names from the first result
-            if results:
-                fieldnames = list(results[0].keys())
-                writer = csv.DictWriter(file, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(results)
-        
-        print(f"Results saved to {output_file}")
-        return output_file
+    Returns:
+        list: List of dictionaries representing rows in the CSV
+    """
+    try:
+        return list(iter_input_rows(file_path))
     except Exception as e:
-        print(f"Error writing results CSV: {str(e)}")
-        print("Attempting to write to current directory instead...")
+        print(f"Error reading CSV file: {str(e)}")
+        return []
+
+def output_path_for(input_file, suffix=".csv", output_dir=None, shard=None):
+    """
+    Work out the timestamped results file name for an input file.
+    
+    Args:
+        input_file (str): Path to the input CSV file
+        suffix (str): Extension of the output file
+        output_dir (str): Directory for the output, defaults to the script directory
+        shard (tuple): (index, count) of a --shard run, named in the file
         
+    Returns:
+        str: Path to the output file
+    """
+    # Get just the filename without the path
+    input_filename = os.path.basename(input_file.strip('"\''))
+    
+    # Generate output file name in the script directory
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_filename = (os.path.splitext(input_filename)[0] + shard_tag(shard)
+                       + f"_results_{timestamp}{suffix}")
+    return os.path.join(output_dir or os.path.dirname(os.path.abspath(__file__)), output_filename)
+
+class ResultsCsvWriter:
+    """
+    Write result rows to the results CSV as they complete.
+    
+    Each row is flushed straight away, so the file on disk is always a
+    readable CSV of every row finished so far.
+    """
+    
+    def __init__(self, input_file, output_dir=None, shard=None):
+        """
+        Args:
+            input_file (str): Path to the input CSV file, used to name the output
+            output_dir (str): Directory for the output, defaults to the script directory
+            shard (tuple): (index, count) of a --shard run, named in the file
+        """
+        self.rows_written = 0
+        self._writer = None
+        self.fallback = False
         try:
+            self.path = output_path_for(input_file, output_dir=output_dir, shard=shard)
+            print(f"Preparing to write results to: {self.path}")
+            self._file = open(self.path, 'w', newline='', encoding='utf-8')
+        except Exception as e:
+            print(f"Error writing results CSV: {str(e)}")
+            print("Attempting to write to current directory instead...")
+            
             # Fallback to a simple filename in the current directory
-            output_file = f"voucher_results_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-            
-            with open(output_file, 'w', newline='', encoding='utf-8') as file:
-                if results:
-                    fieldnames = list(results[0].keys())
-                    writer = csv.DictWriter(file, fieldnames=fieldnames)
-                    writer.writeheader()
-                    writer.writerows(results)
-            
-            print(f"Results saved to {output_file}")
-            return output_file
-        except Exception as e2:
-            print(f"Error in fallback CSV writing: {str(e2)}")
-            return None
+            self.fallback = True
+            self.path = f"voucher_results_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+            self._file = open(self.path, 'w', newline='', encoding='utf-8')
+    
+    def write(self, row):
+        """
+        Append one result row.
+        
+        Args:
+            row (dict): Input columns plus 'Result'
+        """
+        if self._writer is None:
+            # Get all field names from the first result
+            self._writer = csv.DictWriter(self._file, fieldnames=list(row.keys()), extrasaction='ignore')
+            self._writer.writeheader()
+        self._writer.writerow(row)
+        self._file.flush()
+        self.rows_written += 1
+    
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+            print(f"Results saved to {self.path}")
+        return self.path
 
-def generate_html_report(results, output_file):
+def write_results_csv(input_file, results):
     """
-    Generate an HTML report with color-coded results.
+    Write the results to a new CSV file.
     
     Args:
-        results (list): List of dictionaries with results
-        output_file (str): Path to the output CSV file
+        input_file (str): Path to the input CSV file
+        results (iterable): Dictionaries with results
         
     Returns:
-        str: Path to the HTML report
+        str: Path to the output CSV file
     """
+    writer = None
     try:
-        # Generate HTML file name from the CSV file
-        html_file = os.path.splitext(output_file)[0] + ".html"
-        print(f"Preparing to generate HTML report: {html_file}")
-        
-        with open(html_file, 'w', encoding='utf-8') as file:
-            # Write HTML header
-            file.write("""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <title>Voucher Processing Results</title>
-                <style>
-                    body { font-family: Arial, sans-serif; margin: 20px; }
-                    table { border-collapse: collapse; width: 100%; }
-                    th, td { border: 1px solid #ddd; padding: 8px; text-align: left; }
-                    th { background-color: #f2f2f2; }
-                    tr:nth-child(even) { background-color: #f9f9f9; }
-                    .success { background-color: #dff0d8; color: #3c763d; }
-                    .error { background-color: #f2dede; color: #a94442; }
-                    .header { margin-bottom: 20px; }
-                </style>
-            </head>
-            <body>
-                <div class="header">
-                    <h1>Voucher Processing Results</h1>
-                    <p>Generated on: """ + datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") + """</p>
-                </div>
-                <table>
-                    <tr>
-            """)
-            
-            # Write table headers
-            if results:
-                for key in results[0].keys():
-                    file.write(f"<th>{key}</th>")
-                file.write("</tr>")
-                
-                # Write table rows
-                for row in results:
-                    if row.get('Result') == 'Claimed':
-                        file.write('<tr class="success">')
-                    else:
-                        file.write('<tr class="error">')
-                    
-                    for key, value in row.items():
-                        file.write(f"<td>{value}</td>")
-                    
-                    file.write("</tr>")
-            
-            # Write HTML footer
-            file.write("""
-                </table>
-            </body>
-            </html>
-            """)
-        
-        print(f"HTML report generated: {html_file}")
-        return html_file
-    except Exception as e:
-        print(f"Error generating HTML report: {str(e)}")
-        print("Attempting to write HTML report to current directory instead...")
-        
+        writer = ResultsCsvWriter(input_file)
         try:
-            # Fallback to a simple filename in the current directory
-            html_file = f"voucher_results_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.html"
-            
-            with open(html_file, 'w', encoding='utf-8') as file:
-                # Write HTML header
-                file.write("""
-                <!DOCTYPE html>
-                <html>
-                <head>
-                    <title>Voucher Processing Results</title>
-                    <style>
-                        body { font-family: Arial, sans-serif; margin: 20px; }
-                        table { border-collapse: collapse; width: 100%; }
-                        th, td { border: 1px solid #ddd; padding: 8px; text-align: left; }
-                        th { background-color: #f2f2f2; }
-                        tr:nth-child(even) { background-color: #f9f9f9; }
-                        .success { background-color: #dff0d8; color: #3c763d; }
-                        .error { background-color: #f2dede; color: #a94442; }
-                        .header { margin-bottom: 20px; }
-                    </style>
-                </head>
-                <body>
-                    <div class="header">
-                        <h1>Voucher Processing Results</h1>
-                        <p>Generated on: """ + datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") + """</p>
-                    </div>
-                    <table>
-                        <tr>
-                """)
-                
-                # Write table headers
-                if results:
-                    for key in results[0].keys():
-                        file.write(f"<th>{key}</th>")
-                    file.write("</tr>")
-                    
-                    # Write table rows
-                    for row in results:
-                        if row.get('Result') == 'Claimed':
-                            file.write('<tr class="success">')
-                        else:
-                            file.write('<tr class="error">')
-                        
-                        for key, value in row.items():
-                            file.write(f"<td>{value}</td>")
-                        
-                        file.write("</tr>")
-                
-                # Write HTML footer
-                file.write("""
-                    </table>
-                </body>
-                </html>
-                """)
-            
-            print(f"HTML report generated: {html_file}")
-            return html_file
-        except Exception as e2:
-            print(f"Error in fallback HTML report generation: {str(e2)}")
-            return None
+            for row in results:
+                writer.write(row)
+        finally:
+            writer.close()
+        return writer.path
+    except Exception as e:
+        # Without a writer both the output and the fallback file failed to open
+        if writer is not None and not writer.fallback:
+            print(f"Error writing results CSV: {str(e)}")
+        else:
+            print(f"Error in fallback CSV writing: {str(e)}")
+        return None
 
-def main():
+def result_text(success, details=None):
     """
-    Main function to run the voucher automation process.
+    Result column text for a looked-up row.
+    
+    Args:
+        success (bool): Whether the voucher was claimed
+        details (dict): The lookup's details from lookup_vouchers
+        
+    Returns:
+        str: 'Claimed', 'Error', or an error saying the site never answered
     """
-    # Get the CSV file path from the user
-    csv_file = input("Enter the path to the CSV file (default: P6 VExperience 22.02-10.03.25.csv): ")
-    if not csv_file:
-        csv_file = "P6 VExperience 22.02-10.03.25.csv"
+    if success:
+        return 'Claimed'
+    if details and details.get('dead_letter'):
+        return f"{DEAD_LETTER_RESULT} after {details['attempts']} attempts"
+    return 'Error'
+
+def write_dead_letters(path, dead_letters, rows):
+    """
+    Write the rows that never got an answer, so just those can be run again.
     
-    # Print the file path for debugging
-    print(f"Using file path: {csv_file}")
+    Args:
+        path (str): CSV file to write
+        dead_letters (list): DeadLetter records from RetryQueue
+        rows (iterable): (row_index, row) pairs read afresh from the spreadsheet
+        
+    Returns:
+        str: Path to the file, or None if it could not be written
+    """
+    letters = {letter.idx: letter for letter in dead_letters}
+    dead_rows = []
+    for idx, row in rows:
+        letter = letters.pop(idx, None)
+        if letter is not None:
+            row['Attempts'] = letter.attempts
+            row['Last failure'] = letter.failure
+            dead_rows.append(row)
+            if not letters:
+                break
+    if not dead_rows:
+        print(f"Could not write the dead-letter list {path}: the rows are no longer in the spreadsheet")
+        return None
     
     try:
-        # Read the CSV file
-        print(f"Reading CSV file: {csv_file}")
-        data = read_csv_file(csv_file)
-        
-        if not data:
-            print("No data found in the CSV file or file could not be read.")
-            return
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.DictWriter(file, fieldnames=list(dead_rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(dead_rows)
+        return path
+    except Exception as e:
+        print(f"Could not write the dead-letter list {path}: {str(e)}")
+        return None
+
+# Page around the report data. The rows are a JSON block that is only
+# turned into table rows one page at a time, so the report opens instantly
+# whatever its size. @GENERATED@ is replaced when the report is started.
+REPORT_PAGE_HEAD = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Voucher Processing Results</title>
+<style>
+    body { font-family: Arial, sans-serif; margin: 20px; }
+    table { border-collapse: collapse; width: 100%; }
+    th, td { border: 1px solid #ddd; padding: 8px; text-align: left; }
+    th { background-color: #f2f2f2; }
+    .success { background-color: #dff0d8; color: #3c763d; }
+    .error { background-color: #f2dede; color: #a94442; }
+    .header { margin-bottom: 20px; }
+    .summary span { display: inline-block; margin-right: 16px; padding: 4px 8px; cursor: pointer; border: 1px solid #ddd; }
+    .summary span.active { border-color: #333; font-weight: bold; }
+    .controls { margin: 12px 0; }
+    .controls input { margin-right: 12px; }
+</style>
+<script>
+document.addEventListener("DOMContentLoaded", function () {
+    // The data block is a JSON list whose first entry is the column names.
+    // A report from an interrupted run has no closing bracket yet.
+    var text = document.getElementById("report-data").textContent, data;
+    try {
+        data = JSON.parse(text);
+    } catch (error) {
+        data = JSON.parse(text + "]");
+    }
+    var columns = data.shift() || [];
+    var resultColumn = columns.indexOf("Result");
+    var pageSize = 100, page = 0, filter = "All", search = "", shown = data;
+    
+    function escapeHtml(value) {
+        return String(value).replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;").replace(/"/g, "&quot;");
+    }
+    function group(row) {
+        var result = row[resultColumn] || "";
+        if (result === "Claimed") { return "Claimed"; }
+        if (result.indexOf("Could not extract") !== -1) { return "Extraction failed"; }
+        return "Error";
+    }
+    
+    // Summary counts in a single pass over the rows
+    var counts = { "All": data.length, "Claimed": 0, "Error": 0, "Extraction failed": 0 };
+    for (var i = 0; i < data.length; i++) { counts[group(data[i])]++; }
+    var summary = document.getElementById("summary");
+    Object.keys(counts).forEach(function (name) {
+        var item = document.createElement("span");
+        item.textContent = name + ": " + counts[name];
+        item.onclick = function () { filter = name; update(); };
+        item.dataset.group = name;
+        summary.appendChild(item);
+    });
+    
+    function update() {
+        var needle = search.toLowerCase();
+        shown = data.filter(function (row) {
+            return (filter === "All" || group(row) === filter)
+                && (!needle || row.join(" | ").toLowerCase().indexOf(needle) !== -1);
+        });
+        page = 0;
+        Array.prototype.forEach.call(summary.children, function (item) {
+            item.className = item.dataset.group === filter ? "active" : "";
+        });
+        render();
+    }
+    function render() {
+        var pages = Math.max(1, Math.ceil(shown.length / pageSize));
+        page = Math.min(Math.max(page, 0), pages - 1);
+        var html = ["<tr>"];
+        columns.forEach(function (name) { html.push("<th>" + escapeHtml(name) + "</th>"); });
+        html.push("</tr>");
+        shown.slice(page * pageSize, (page + 1) * pageSize).forEach(function (row) {
+            html.push(row[resultColumn] === "Claimed" ? '<tr class="success">' : '<tr class="error">');
+            row.forEach(function (value) { html.push("<td>" + escapeHtml(value) + "</td>"); });
+            html.push("</tr>");
+        });
+        document.getElementById("results").innerHTML = html.join("");
+        document.getElementById("page-info").textContent =
+            "Page " + (page + 1) + " of " + pages + " (" + shown.length + " rows)";
+    }
+    
+    document.getElementById("previous").onclick = function () { page--; render(); };
+    document.getElementById("next").onclick = function () { page++; render(); };
+    document.getElementById("search").oninput = function () { search = this.value; update(); };
+    document.getElementById("page-size").onchange = function () { pageSize = parseInt(this.value, 10); render(); };
+    update();
+});
+</script>
+</head>
+<body>
+<div class="header">
+    <h1>Voucher Processing Results</h1>
+    <p>Generated on: @GENERATED@</p>
+    <div class="summary" id="summary"></div>
+</div>
+<div class="controls">
+    <input id="search" type="search" placeholder="Search">
+    <button id="previous">&lt; Previous</button>
+    <span id="page-info"></span>
+    <button id="next">Next &gt;</button>
+    <select id="page-size"><option>100</option><option>500</option><option>1000</option></select>
+</div>
+<noscript>This report needs JavaScript to show the results; the results CSV has the same data.</noscript>
+<table id="results"></table>
+<script type="application/json" id="report-data">[
+"""
+
+REPORT_PAGE_FOOT = """
+]</script>
+</body>
+</html>
+"""
+
+class HtmlReportWriter:
+    """
+    Write the color-coded HTML report as result rows complete.
+    
+    Each row is appended to a compact JSON block in the page and flushed, and
+    the page's script shows the rows a page at a time with summary counts,
+    filters and search. A partial report from an interrupted run opens too.
+    """
+    
+    def __init__(self, output_file):
+        """
+        Args:
+            output_file (str): Path to the output CSV file, used to name the report
+        """
+        self._columns = None
+        self._columns_written = False
+        self.fallback = False
+        try:
+            # Generate HTML file name from the CSV file
+            self.path = os.path.splitext(output_file)[0] + ".html"
+            print(f"Preparing to generate HTML report: {self.path}")
+            self._file = open(self.path, 'w', encoding='utf-8')
+        except Exception as e:
+            print(f"Error generating HTML report: {str(e)}")
+            print("Attempting to write HTML report to current directory instead...")
+            
+            # Fallback to a simple filename in the current directory
+            self.fallback = True
+            self.path = f"voucher_results_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.html"
+            self._file = open(self.path, 'w', encoding='utf-8')
+        
+        self._file.write(REPORT_PAGE_HEAD.replace("@GENERATED@", datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        self._file.flush()
+    
+    def _write_json(self, values):
+        # "<" is escaped so no value can close the script block early
+        separator = ",\n" if self._columns_written else ""
+        self._file.write(separator + json.dumps(values, ensure_ascii=False).replace("<", "\\u003c"))
+        self._columns_written = True
+    
+    def write(self, row):
+        """
+        Append one result row.
+        
+        Args:
+            row (dict): Input columns plus 'Result'
+        """
+        # The first entry holds the column names
+        if self._columns is None:
+            self._columns = list(row.keys())
+            self._write_json(self._columns)
+        
+        self._write_json(["" if row.get(key) is None else str(row.get(key)) for key in self._columns])
+        self._file.flush()
+    
+    def close(self):
+        if not self._file.closed:
+            self._file.write(REPORT_PAGE_FOOT)
+            self._file.close()
+            print(f"HTML report generated: {self.path}")
+        return self.path
+
+def generate_html_report(results, output_file):
+    """
+    Generate an HTML report with color-coded results.
+    
+    Args:
+        results (iterable): Dictionaries with results
+        output_file (str): Path to the output CSV file
+        
+    Returns:
+        str: Path to the HTML report
+    """
+    report = None
+    try:
+        report = HtmlReportWriter(output_file)
+        try:
+            for row in results:
+                report.write(row)
+        finally:
+            report.close()
+        return report.path
+    except Exception as e:
+        # Without a writer both the report and the fallback file failed to open
+        if report is not None and not report.fallback:
+            print(f"Error generating HTML report: {str(e)}")
+        else:
+            print(f"Error in fallback HTML report generation: {str(e)}")
+        return None
+
+# URL patterns a lean browser never downloads: images, fonts, media and
+# third-party analytics/tag hosts. None of them are needed to find the
+# search form or the result page elements.
+LEAN_BLOCKED_URLS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico", "*.bmp",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.mp4", "*.webm", "*.mp3", "*.wav", "*.ogg",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*",
+    "*facebook.net*", "*facebook.com/tr*", "*hotjar.com*", "*clarity.ms*",
+    "*fonts.googleapis.com*", "*fonts.gstatic.com*",
+]
+
+def create_chrome_driver(lean=False):
+    """
+    Launch a new Chrome session using the ChromeDriver in the script directory.
+    
+    Args:
+        lean (bool): Run headless with an eager page-load strategy, and block
+            images, fonts, media and third-party hosts
+    
+    Returns:
+        WebDriver: Selenium WebDriver instance
+    """
+    from selenium import webdriver
+    
+    # Set up Chrome options
+    from selenium.webdriver.chrome.options import Options
+    chrome_options = Options()
+    
+    # Add some options to make Chrome more stable
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--window-size=1920,1080")
+    
+    # Keep timers and rendering at full speed in tabs that aren't in front,
+    # so lookups in background tabs (--tabs) aren't slowed down
+    chrome_options.add_argument("--disable-background-timer-throttling")
+    chrome_options.add_argument("--disable-renderer-backgrounding")
+    chrome_options.add_argument("--disable-backgrounding-occluded-windows")
+    
+    if lean:
+        # No window, no images, and hand control back once the DOM is ready
+        # rather than after every asset has loaded
+        chrome_options.add_argument("--headless=new")
+        chrome_options.add_argument("--disable-extensions")
+        chrome_options.add_argument("--mute-audio")
+        chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+        chrome_options.add_experimental_option("prefs", {
+            "profile.managed_default_content_settings.images": 2,
+            "profile.default_content_setting_values.notifications": 2,
+        })
+        chrome_options.page_load_strategy = "eager"
+    
+    # Use the ChromeDriver in the current directory
+    from selenium.webdriver.chrome.service import Service
+    chrome_driver_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chromedriver.exe")
+    print(f"Using ChromeDriver at: {chrome_driver_path}")
+    
+    # Create a Service object
+    service = Service(executable_path=chrome_driver_path)
+    
+    # Initialize Chrome with the service and options
+    print("Initializing lean headless Chrome..." if lean else "Initializing Chrome...")
+    driver = webdriver.Chrome(service=service, options=chrome_options)
+    
+    if lean:
+        # Fonts, media and third-party scripts have no preference switch, so
+        # block them at the network layer through DevTools
+        try:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": LEAN_BLOCKED_URLS})
+            # Present the same user agent as a normal window
+            user_agent = driver.execute_script("return navigator.userAgent")
+            driver.execute_cdp_cmd("Network.setUserAgentOverride",
+                                   {"userAgent": user_agent.replace("HeadlessChrome", "Chrome")})
+        except Exception as e:
+            print(f"Could not enable request blocking: {str(e)}")
+    return driver
+
+def add_login_cookies(driver, cookies):
+    """
+    Load the search page in a browser with the given login cookies.
+    
+    Args:
+        driver (WebDriver): Browser to log in
+        cookies (list): Cookie dicts as returned by driver.get_cookies()
+    """
+    # Cookies can only be added for the domain currently loaded
+    driver.get(SEARCH_URL)
+    for cookie in cookies:
+        try:
+            driver.add_cookie(cookie)
+        except Exception as e:
+            print(f"Could not copy cookie {cookie.get('name')}: {str(e)}")
+    
+    # Reload so the site picks up the session
+    driver.get(SEARCH_URL)
+
+def share_login_cookies(source_driver, target_driver):
+    """
+    Copy the logged-in session cookies from one browser to another.
+    
+    Args:
+        source_driver (WebDriver): Browser that has completed the login
+        target_driver (WebDriver): Browser that should reuse the login
+    """
+    add_login_cookies(target_driver, source_driver.get_cookies())
+
+def is_logged_in(driver):
+    """Check whether the browser is showing the voucher search form."""
+    from selenium.webdriver.common.by import By
+    try:
+        return bool(driver.find_elements(By.ID, "ctl00_cphMain_tbxSerialNo"))
+    except Exception:
+        return False
+
+class BrowserTabs:
+    """
+    One Chrome shared by several lookups, each in a tab of its own.
+    
+    WebDriver commands always go to the browser's current tab, so each
+    command from a tab switches to it first, holding a lock for just that
+    command. A lookup waiting for the site polls between commands without
+    the lock, so the other tabs submit and read their results in the
+    meantime and the site's response times overlap, without the memory of
+    a browser per lookup. Page loads are started with a script and waited
+    for the same way, so a tab going back to the search page doesn't hold
+    up the others either. The tabs share the browser's login cookies.
+    """
+    
+    def __init__(self, driver):
+        """
+        Args:
+            driver (WebDriver): Logged-in browser; its current window is the first tab
+        """
+        self.driver = driver
+        self.handles = []
+        self._lock = threading.Lock()
+        self._current = driver.current_window_handle
+    
+    def open_tab(self):
+        """
+        Open a tab on the search page (the first call uses the current window).
+        
+        Returns:
+            TabDriver: The tab, to be used like a WebDriver
+        """
+        with self._lock:
+            first = not self.handles
+            if not first:
+                self.driver.switch_to.new_window('tab')
+                self._current = self.driver.current_window_handle
+            self.handles.append(self._current)
+            tab = TabDriver(self, self._current)
+        if not first:
+            tab.get(SEARCH_URL)
+        return tab
+    
+    def run(self, handle, command, *args):
+        """Run one WebDriver command in the given tab."""
+        with self._lock:
+            if self._current != handle:
+                self.driver.switch_to.window(handle)
+                self._current = handle
+            return command(*args)
+    
+    def close_tab(self, handle):
+        """Close a tab, or quit the browser if it is the last one."""
+        with self._lock:
+            self.handles.remove(handle)
+            if not self.handles:
+                self.driver.quit()
+                return
+            if self._current != handle:
+                self.driver.switch_to.window(handle)
+            self.driver.close()
+            
+            # Leave the browser on a tab that still exists
+            self._current = self.handles[0]
+            self.driver.switch_to.window(self._current)
+
+class TabDriver:
+    """
+    One tab of a BrowserTabs browser, with the parts of the WebDriver
+    interface that process_voucher and its helpers use.
+    """
+    
+    def __init__(self, browser, handle):
+        self.browser = browser
+        self.handle = handle
+    
+    def _run(self, command, *args):
+        return self._wrap(self.browser.run(self.handle, command, *args))
+    
+    def _wrap(self, value):
+        # Elements found in this tab must be used from this tab too
+        from selenium.webdriver.remote.webelement import WebElement
+        if isinstance(value, WebElement):
+            return TabElement(self, value)
+        if isinstance(value, list):
+            return [self._wrap(item) for item in value]
+        return value
+    
+    def execute_script(self, script, *args):
+        args = [arg.element if isinstance(arg, TabElement) else arg for arg in args]
+        return self._run(self.browser.driver.execute_script, script, *args)
+    
+    def find_element(self, by, value):
+        return self._run(self.browser.driver.find_element, by, value)
+    
+    def find_elements(self, by, value):
+        return self._run(self.browser.driver.find_elements, by, value)
+    
+    def get(self, url, timeout=30):
+        # driver.get would hold the browser until the page loads, so start the
+        # navigation from a script and poll for the new page between commands
+        from selenium.common.exceptions import TimeoutException, WebDriverException
+        self._run(self.browser.driver.execute_script,
+                  "window.__tabNavigating = true; window.location.href = arguments[0];", url)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if self._run(self.browser.driver.execute_script,
+                             "return !window.__tabNavigating && document.readyState === 'complete';"):
+                    return
+            except WebDriverException:
+                # The old page can go away under a script mid-navigation
+                pass
+            time.sleep(0.05)
+        raise TimeoutException(f"Timed out loading {url} in a tab")
+    
+    def get_cookies(self):
+        return self._run(self.browser.driver.get_cookies)
+    
+    def add_cookie(self, cookie):
+        return self._run(self.browser.driver.add_cookie, cookie)
+    
+    @property
+    def current_url(self):
+        return self._run(lambda: self.browser.driver.current_url)
+    
+    def quit(self):
+        """Close this tab (the browser quits with its last tab)."""
+        self.browser.close_tab(self.handle)
+
+class TabElement:
+    """An element found in a TabDriver tab, whose actions run in that tab."""
+    
+    def __init__(self, tab, element):
+        self.tab = tab
+        self.element = element
+    
+    @property
+    def id(self):
+        return self.element.id
+    
+    def get_attribute(self, name):
+        return self.tab._run(self.element.get_attribute, name)
+    
+    def clear(self):
+        return self.tab._run(self.element.clear)
+    
+    def send_keys(self, *value):
+        return self.tab._run(self.element.send_keys, *value)
+    
+    def click(self):
+        # Clicked from a script that returns straight away, so a click that
+        # loads a page doesn't hold the browser while the site answers
+        self.tab.execute_script("var element = arguments[0]; setTimeout(function () { element.click(); }, 0);", self)
+
+class WatchedDriver:
+    """
+    A Chrome session that replaces itself when it dies, hangs, grows too
+    large or has done a set number of lookups.
+    
+    A long run in one Chrome steadily gains memory, and now and then the
+    browser hangs or crashes, after which every lookup would fail. After a
+    lookup that got no answer, the watchdog checks the browser still responds;
+    every few lookups it notes the login cookies and, if a limit is set, the
+    memory of the browser's processes. When needed it quits the browser and
+    opens a fresh one logged in with the noted cookies. Everything else is
+    passed through to the current browser, so it is used like a WebDriver.
+    """
+    
+    # Lookups between cookie snapshots and memory checks
+    CHECK_EVERY = 20
+    
+    def __init__(self, driver, reopen, recycle_after=None, max_memory_mb=None, probe_timeout=10):
+        """
+        Args:
+            driver (WebDriver): Logged-in browser to watch
+            reopen (callable): Called as reopen(cookies) to open a replacement
+                browser logged in with those cookies
+            recycle_after (int): Lookups before the browser is replaced
+                anyway, or None to only replace it when needed
+            max_memory_mb (float): Replace the browser once its processes use
+                more than this (needs psutil), or None
+            probe_timeout (float): Seconds a healthy browser takes at most to
+                answer a trivial command, or to quit
+        """
+        self.driver = driver
+        self.reopen = reopen
+        self.recycle_after = recycle_after
+        self.max_memory_mb = max_memory_mb
+        self.probe_timeout = probe_timeout
+        self.lookups = 0
+        self.restarts = 0
+        self.cookies = []
+        self._note_cookies()
+    
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+    
+    def _note_cookies(self):
+        try:
+            self.cookies = self.driver.get_cookies()
+        except Exception:
+            pass
+    
+    def responsive(self):
+        """Check the browser answers a trivial command within probe_timeout."""
+        answers = []
+        
+        def probe():
+            try:
+                answers.append(self.driver.execute_script("return document.readyState"))
+            except Exception:
+                pass
+        
+        prober = threading.Thread(target=probe, daemon=True)
+        prober.start()
+        prober.join(self.probe_timeout)
+        return bool(answers)
+    
+    def _browser_processes(self):
+        # Chrome's processes are the children of its ChromeDriver
+        try:
+            import psutil
+            return psutil.Process(self.driver.service.process.pid).children(recursive=True)
+        except Exception:
+            return []
+    
+    def memory_mb(self):
+        """Memory used by the browser's processes in MB, or None if it can't be measured."""
+        total = 0
+        processes = self._browser_processes()
+        for process in processes:
+            try:
+                total += process.memory_info().rss
+            except Exception:
+                pass
+        return total / (1024 * 1024) if processes else None
+    
+    def after_lookup(self, details):
+        """
+        Check the browser after a lookup and replace it if needed.
+        
+        Args:
+            details (dict): Details of the lookup just made
+            
+        Returns:
+            bool: True if the browser had stopped responding and was replaced,
+                so the lookup was lost to the browser rather than answered
+        """
+        self.lookups += 1
+        reason = None
+        if details.get('outcome') is None and not self.responsive():
+            reason = "it stopped responding"
+        elif self.recycle_after and self.lookups >= self.recycle_after:
+            reason = f"{self.lookups} lookups"
+        elif self.lookups % self.CHECK_EVERY == 0:
+            self._note_cookies()
+            memory = self.memory_mb() if self.max_memory_mb else None
+            if memory is not None and memory > self.max_memory_mb:
+                reason = f"its memory reached {memory:.0f} MB"
+        
+        if reason is None:
+            return False
+        lost = reason == "it stopped responding"
+        return self.restart(reason, alive=not lost) and lost
+    
+    def restart(self, reason, alive=True):
+        """
+        Quit the browser and open a fresh one with the same login.
+        
+        Returns:
+            bool: True if the new browser was opened
+        """
+        print(f"Restarting Chrome because {reason}...")
+        if alive:
+            self._note_cookies()
+        old_driver = self.driver
+        old_processes = self._browser_processes()
+        
+        def quit_old():
+            try:
+                old_driver.quit()
+            except Exception:
+                pass
+        
+        closer = threading.Thread(target=quit_old, daemon=True)
+        closer.start()
+        closer.join(self.probe_timeout)
+        if closer.is_alive():
+            # A hung browser doesn't answer quit, so stop its processes instead
+            for process in old_processes:
+                try:
+                    process.kill()
+                except Exception:
+                    pass
+            try:
+                old_driver.service.stop()
+            except Exception:
+                pass
+        
+        try:
+            self.driver = self.reopen(self.cookies)
+        except Exception as e:
+            print(f"Could not restart Chrome: {str(e)}")
+            return False
+        self.lookups = 0
+        self.restarts += 1
+        return True
+
+class FixedThrottle:
+    """
+    Pause for a fixed time after every lookup, as the original loop did.
+    """
+    
+    def __init__(self, delay=1.0):
+        self.delay = delay
+    
+    def acquire(self):
+        """Wait until another lookup may start."""
+    
+    def release(self, latency, healthy, outcome=None):
+        """
+        Record a finished lookup.
+        
+        Args:
+            latency (float): Seconds the lookup took
+            healthy (bool): False if the site errored or timed out
+            outcome (str): Result page reached (unused)
+        """
+        time.sleep(self.delay)
+    
+    def describe(self):
+        return f"fixed {self.delay:.2f}s pause after each lookup"
+
+class AdaptiveThrottle:
+    """
+    Pace lookups from measured latency and failures using AIMD.
+    
+    Healthy, fast responses raise the rate of lookup starts (one over the
+    delay between them) and widen the window of lookups allowed in flight by
+    small steps (additive increase), so the delay recovers from a long
+    back-off in a few dozen lookups rather than hours.
+    A timeout or an unrecognised page, or a run of responses much slower than
+    usual, doubles the delay and halves the window (multiplicative decrease).
+    Both are kept within the configured floors and ceilings. One instance is
+    shared by every worker, so it paces the single browser loop and a worker
+    pool alike. The delay is the gap for each slot in the window, so lookups
+    start window times as often overall and more workers or tabs still scale.
+    
+    The usual latency is tracked per result page, since a claim or success
+    page also needs the Abandon step and so always takes longer than an
+    invalid serial/PIN.
+    """
+    
+    def __init__(self, min_delay=0.25, max_delay=30.0, start_delay=1.0,
+                 min_window=1, max_window=1, rate_step=0.1, backoff_floor=0.05, slow_factor=2.0,
+                 slow_margin=0.5, slow_run=3):
+        """
+        Args:
+            min_delay (float): Shortest gap in seconds between lookup starts in
+                each slot of the window
+            max_delay (float): Longest gap the throttle will back off to
+            start_delay (float): Gap to start with
+            min_window (int): Fewest lookups allowed in flight
+            max_window (int): Most lookups allowed in flight (e.g. worker count)
+            rate_step (float): Lookups per second added to the rate after each
+                healthy lookup
+            backoff_floor (float): Gap the first back-off from no gap at all goes to
+            slow_factor (float): A lookup slower than this multiple of the
+                typical latency for its result page counts as slow
+            slow_margin (float): Seconds a lookup must also exceed its typical
+                latency by, so jitter on fast lookups isn't counted as slow
+            slow_run (int): Slow lookups in a row that count as the site struggling
+        """
+        self.min_delay = min_delay
+        self.max_delay = max(max_delay, min_delay)
+        self.delay = min(max(start_delay, self.min_delay), self.max_delay)
+        self.min_window = max(1, min_window)
+        self.max_window = max(self.min_window, max_window)
+        self.window = float(self.max_window)
+        self.rate_step = rate_step
+        self.backoff_floor = backoff_floor
+        self.slow_factor = slow_factor
+        self.slow_margin = slow_margin
+        self.slow_run = max(1, slow_run)
+        
+        self.typical_latency = {}
+        self.slow_streak = 0
+        self.in_flight = 0
+        self.next_start = 0.0
+        self.last_backoff = 0.0
+        self.lookups = 0
+        self.backoffs = 0
+        self._condition = threading.Condition()
+    
+    def acquire(self):
+        """Wait for a free slot in the window and for the pacing gap to pass."""
+        with self._condition:
+            while self.in_flight >= int(self.window):
+                self._condition.wait()
+            self.in_flight += 1
+            
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.delay / max(1, int(self.window))
+        
+        if start > now:
+            time.sleep(start - now)
+    
+    def release(self, latency, healthy, outcome=None):
+        """
+        Record a finished lookup and adjust the pacing.
+        
+        Args:
+            latency (float): Seconds the lookup took
+            healthy (bool): False if the site errored or timed out
+            outcome (str): Result page reached, so the latency is compared
+                with earlier lookups that reached the same page
+        """
+        with self._condition:
+            self.in_flight -= 1
+            self.lookups += 1
+            
+            typical = self.typical_latency.get(outcome)
+            slow = (
+                healthy
+                and typical is not None
+                and latency > max(typical * self.slow_factor, typical + self.slow_margin)
+            )
+            self.slow_streak = self.slow_streak + 1 if slow else 0
+            
+            if not healthy or self.slow_streak >= self.slow_run:
+                # Multiplicative decrease, at most once per typical lookup so a
+                # burst of failures from the same slowdown only counts once
+                now = time.monotonic()
+                if now - self.last_backoff >= max(self.typical_latency.values(), default=1.0):
+                    self.last_backoff = now
+                    self.backoffs += 1
+                    self.delay = min(self.max_delay, max(self.delay * 2, self.min_delay, self.backoff_floor))
+                    self.window = max(float(self.min_window), self.window / 2)
+                    reason = "slow responses" if healthy else "failed lookup"
+                    print(f"Throttle: backing off after {reason} ({latency:.1f}s) - "
+                          f"{self.delay:.2f}s between lookups, {int(self.window)} in flight")
+                self.slow_streak = 0
+            elif not slow:
+                # Additive increase of the rate 1/delay, and one more slot per window's worth of successes
+                self.delay = max(self.min_delay, self.delay / (1 + self.rate_step * self.delay))
+                self.window = min(self.max_window, self.window + 1.0 / self.window)
+            
+            if healthy:
+                if typical is None:
+                    self.typical_latency[outcome] = latency
+                elif not slow:
+                    self.typical_latency[outcome] = 0.8 * typical + 0.2 * latency
+            
+            self._condition.notify_all()
+    
+    def describe(self):
+        return (f"adaptive, ended at {self.delay:.2f}s between lookups with "
+                f"{int(self.window)} in flight after {self.backoffs} back-offs")
+
+# Upper bounds in seconds of the latency histogram buckets (Prometheus style)
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class PhaseHistogram:
+    """Bucketed latency histogram for one lookup phase."""
+    
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+    
+    def observe(self, seconds):
+        index = 0
+        while index < len(self.buckets) and seconds > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+    
+    def quantile(self, fraction):
+        """Estimate a quantile by interpolating within its bucket."""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        lower = 0.0
+        for upper, count in zip(self.buckets + (self.max,), self.counts):
+            if count and seen + count >= rank:
+                upper = min(upper, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return self.max
+    
+    def to_dict(self):
+        cumulative = list(itertools.accumulate(self.counts))
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+            "max": round(self.max, 6),
+            "p50": round(self.quantile(0.50), 6),
+            "p90": round(self.quantile(0.90), 6),
+            "p99": round(self.quantile(0.99), 6),
+            "buckets": {**{str(bound): total for bound, total in zip(self.buckets, cumulative)},
+                        "+Inf": cumulative[-1]},
+        }
+
+class RunMetrics:
+    """
+    Timing histograms per lookup phase and counters per outcome branch.
+    
+    Fed from the details dict of every finished lookup, and written at the
+    end of a run as a JSON summary and a Prometheus text file (suitable for
+    the node_exporter textfile collector). With dump_interval set, both files
+    are also rewritten during the run so it can be watched live. One instance
+    is shared by every worker.
+    """
+    
+    # Outcome branches, counted even when zero so every run exports the same series
+    BRANCHES = (OUTCOME_INVALID, OUTCOME_CLAIM_PAGE, OUTCOME_SUCCESS_PAGE,
+                OUTCOME_GENERIC_ABANDON, "unrecognised", "reset", "exception")
+    
+    def __init__(self, json_path=None, prom_path=None, dump_interval=None):
+        """
+        Args:
+            json_path (str): Where to write the JSON summary
+            prom_path (str): Where to write the Prometheus text file
+            dump_interval (float): Seconds between live rewrites of both
+                files, or None to write them only at the end
+        """
+        self.json_path = json_path
+        self.prom_path = prom_path
+        self.dump_interval = dump_interval
+        self.started = time.time()
+        self.phases = {}
+        self.branches = collections.Counter({branch: 0 for branch in self.BRANCHES})
+        self.last_dump = time.monotonic()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+    
+    def observe_phase(self, phase, seconds):
+        with self._lock:
+            self._observe_phase(phase, seconds)
+    
+    def _observe_phase(self, phase, seconds):
+        histogram = self.phases.get(phase)
+        if histogram is None:
+            histogram = self.phases[phase] = PhaseHistogram()
+        histogram.observe(seconds)
+    
+    def observe_lookup(self, details):
+        """
+        Record one finished lookup.
+        
+        Args:
+            details (dict): The lookup's details, with 'phases', 'outcome',
+                'exception' and 'elapsed' as filled in by process_voucher
+                and lookup_vouchers
+        """
+        with self._lock:
+            for phase, seconds in details.get('phases', {}).items():
+                self._observe_phase(phase, seconds)
+            if details.get('elapsed') is not None:
+                self._observe_phase('lookup', details['elapsed'])
+            self.branches[details.get('outcome') or 'unrecognised'] += 1
+            if 'reset' in details.get('phases', {}):
+                self.branches['reset'] += 1
+            if details.get('exception'):
+                self.branches['exception'] += 1
+            
+            due = (
+                self.dump_interval is not None
+                and time.monotonic() - self.last_dump >= self.dump_interval
+            )
+            if due:
+                self.last_dump = time.monotonic()
+        if due:
+            self.write()
+    
+    def to_dict(self):
+        with self._lock:
+            phases = {phase: histogram.to_dict() for phase, histogram in sorted(self.phases.items())}
+            branches = dict(self.branches)
+        # 'lookup' and 'throttle' wrap the other phases, so leave them out of the ranking
+        ranked = sorted((phase for phase in phases if phase not in ('lookup', 'throttle')),
+                        key=lambda phase: phases[phase]["sum"], reverse=True)
+        return {
+            "started": datetime.datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+            "elapsed": round(time.time() - self.started, 3),
+            "lookups": phases.get('lookup', {}).get("count", 0),
+            "branches": branches,
+            "slowest_phases": ranked,
+            "phases": phases,
+        }
+    
+    def to_prometheus(self):
+        summary = self.to_dict()
+        lines = [
+            "# HELP voucher_phase_seconds Time spent in each phase of a voucher lookup.",
+            "# TYPE voucher_phase_seconds histogram",
+        ]
+        for phase, histogram in summary["phases"].items():
+            for bound, total in histogram["buckets"].items():
+                lines.append(f'voucher_phase_seconds_bucket{{phase="{phase}",le="{bound}"}} {total}')
+            lines.append(f'voucher_phase_seconds_sum{{phase="{phase}"}} {histogram["sum"]}')
+            lines.append(f'voucher_phase_seconds_count{{phase="{phase}"}} {histogram["count"]}')
+        lines += [
+            "# HELP voucher_branch_total Lookups by outcome branch taken.",
+            "# TYPE voucher_branch_total counter",
+        ]
+        for branch, count in summary["branches"].items():
+            lines.append(f'voucher_branch_total{{branch="{branch}"}} {count}')
+        lines += [
+            "# HELP voucher_run_seconds Seconds since the run started.",
+            "# TYPE voucher_run_seconds gauge",
+            f"voucher_run_seconds {summary['elapsed']}",
+        ]
+        return "\n".join(lines) + "\n"
+    
+    def write(self):
+        """Write the JSON summary and Prometheus file, replacing them atomically."""
+        with self._write_lock:
+            for path, render in ((self.json_path, lambda: json.dumps(self.to_dict(), indent=2)),
+                                 (self.prom_path, self.to_prometheus)):
+                if not path:
+                    continue
+                temp_path = path + ".tmp"
+                with open(temp_path, 'w', encoding='utf-8') as file:
+                    file.write(render())
+                os.replace(temp_path, path)
+    
+    def describe(self):
+        """One line per phase, slowest in total first."""
+        summary = self.to_dict()
+        lines = []
+        for phase in summary["slowest_phases"] + [p for p in ('throttle', 'lookup') if p in summary["phases"]]:
+            histogram = summary["phases"][phase]
+            lines.append(f"  {phase:<11} total {histogram['sum']:8.2f}s  mean {histogram['mean'] * 1000:7.0f}ms  "
+                         f"p90 {histogram['p90'] * 1000:7.0f}ms  max {histogram['max'] * 1000:7.0f}ms")
+        return "\n".join(lines)
+
+def lookup_kind(success, details):
+    """
+    Work out what a finished lookup means for its row.
+    
+    A row only counts as rejected when the site gave a recognisable answer;
+    timeouts, unrecognised pages and browser errors say nothing about the
+    voucher, so they are transient and can be retried.
+    
+    Args:
+        success (bool): What the lookup function returned
+        details (dict): The lookup's details, with 'outcome'
+        
+    Returns:
+        str: LOOKUP_CLAIMED, LOOKUP_REJECTED or LOOKUP_TRANSIENT
+    """
+    outcome = details.get('outcome')
+    # The success page means claimed even if going back from it then failed
+    if success or outcome == OUTCOME_SUCCESS_PAGE:
+        return LOOKUP_CLAIMED
+    if outcome is None:
+        return LOOKUP_TRANSIENT
+    return LOOKUP_REJECTED
+
+class DeadLetter:
+    """
+    A row that never got an answer from the site.
+    
+    Only the row's number, serial/PIN and how it failed are kept; its cells
+    are read back from the spreadsheet when the dead-letter list is written.
+    """
+    
+    __slots__ = ('idx', 'serial', 'pin', 'attempts', 'failure')
+    
+    def __init__(self, idx, serial, pin, attempts, failure):
+        self.idx = idx
+        self.serial = serial
+        self.pin = pin
+        self.attempts = attempts
+        self.failure = failure
+
+class RetryQueue:
+    """
+    Rows whose lookup failed transiently, waiting to be tried again.
+    
+    Each retry waits twice as long as the one before (with a little jitter,
+    so workers don't retry in step). A row that still fails after
+    max_attempts lookups goes on the dead-letter list instead. The queue also
+    counts lookups in progress, so workers know when no more retries can
+    arrive. One instance is shared by every worker.
+    """
+    
+    def __init__(self, max_attempts=3, base_delay=5.0, max_delay=120.0):
+        """
+        Args:
+            max_attempts (int): Lookups per row, including the first
+            base_delay (float): Seconds before the first retry
+            max_delay (float): Longest wait before a retry
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.attempts = {}
+        self.dead_letters = []
+        self.retried = 0
+        self.active = 0
+        self._due = []
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+    
+    def begin(self, item):
+        """Note that a lookup of item has started."""
+        with self._lock:
+            self.active += 1
+            self.attempts[item[0]] = self.attempts.get(item[0], 0) + 1
+    
+    def end(self, item, kind, details):
+        """
+        Note that a lookup of item has finished, and queue it for another
+        try if it failed transiently and has attempts left.
+        
+        Args:
+            item (tuple): The looked-up item
+            kind (str): What lookup_kind made of the result
+            details (dict): The lookup's details
+            
+        Returns:
+            float: Seconds until the retry, or None if the result is final
+        """
+        with self._lock:
+            self.active -= 1
+            attempt = self.attempts.get(item[0], 1)
+            if kind != LOOKUP_TRANSIENT:
+                self.attempts.pop(item[0], None)
+                return None
+            if attempt >= self.max_attempts:
+                self.attempts.pop(item[0], None)
+                self.dead_letters.append(DeadLetter(item[0], item[2], item[3], attempt,
+                                                    details.get('exception') or "No result page recognised"))
+                return None
+            
+            delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1)) * random.uniform(0.8, 1.2)
+            heapq.heappush(self._due, (time.monotonic() + delay, next(self._order), item))
+            self.retried += 1
+            return delay
+    
+    def pop_due(self):
+        """Return an item whose retry is due, or None."""
+        with self._lock:
+            if self._due and self._due[0][0] <= time.monotonic():
+                return heapq.heappop(self._due)[2]
+        return None
+    
+    def next_due_in(self):
+        """Seconds until the next retry is due, or None if none are waiting."""
+        with self._lock:
+            if not self._due:
+                return None
+            return max(0.0, self._due[0][0] - time.monotonic())
+    
+    def settled(self):
+        """True when no retries are waiting and no lookups are in progress."""
+        with self._lock:
+            return not self._due and not self.active
+    
+    def describe(self):
+        return (f"{self.retried} retries of transient failures, "
+                f"{len(self.dead_letters)} rows still failing after {self.max_attempts} attempts")
+
+def lookup_vouchers(driver, items, workers=1, outcome_timeout=OUTCOME_TIMEOUT,
+                    open_session=None, lookup_func=process_voucher, throttle=None, on_result=None,
+                    metrics=None, retries=None, close_session=None):
+    """
+    Look up vouchers as rows arrive, either in the given session or in a pool
+    of independent sessions sharing its login.
+    
+    Args:
+        driver (WebDriver): Logged-in session, used by the first worker
+        items (iterable): (row_index, row, serial, pin, result) tuples from
+            plan_rows, where row may be None as the lookups never read it;
+            items that already have a result are passed straight through,
+            and None means no row is ready yet but more may follow
+        workers (int): Number of sessions to run at once
+        outcome_timeout (float): Seconds to wait for each result page
+        open_session (callable): Creates a further logged-in session for
+            each extra worker (defaults to a new Chrome sharing the login)
+        lookup_func (callable): Function with the process_voucher contract
+        throttle (AdaptiveThrottle): Paces the lookups across all workers
+            (defaults to a fixed one-second pause after each lookup)
+        on_result (callable): Called as on_result(idx, serial, pin, success, details)
+            as soon as each row has its final result, on the thread reading
+            the results rather than the one doing the lookup
+        metrics (RunMetrics): Receives the phase timings and outcome branch
+            of every lookup, including time spent waiting on the throttle
+        retries (RetryQueue): Retries rows that got no answer from the site
+            (defaults to three attempts per row)
+        close_session (callable): Called with each session from open_session
+            once its worker has finished (defaults to quitting it)
+        
+    Yields:
+        tuple: (item, success, details) as each item finishes, which with
+            several workers is not necessarily row order. success is None
+            for items that were passed through without a lookup. details
+            has the lookup_kind ('kind') and the number of lookups made
+            ('attempts'), and 'dead_letter' if it never got an answer.
+    """
+    outcome_states = collections.Counter()
+    outcomes_lock = threading.Lock()
+    
+    if throttle is None:
+        throttle = FixedThrottle()
+    if retries is None:
+        retries = RetryQueue()
+    
+    if open_session is None:
+        def open_session():
+            new_driver = create_chrome_driver()
+            share_login_cookies(driver, new_driver)
+            return new_driver
+    if close_session is None:
+        def close_session(session):
+            session.quit()
+    
+    def lookup(lookup_driver, item):
+        # Returns (success, details), or None if the row was queued for a retry
+        idx, row, serial, pin, result = item
+        details = {}
+        success = False
+        retries.begin(item)
+        try:
+            with phase_span(details, 'throttle'):
+                throttle.acquire()
+            started = time.time()
+            try:
+                success = lookup_func(lookup_driver, serial, pin, outcome_timeout, details)
+                
+                # A lookup lost to a dead or hung browser is made again in its replacement
+                if isinstance(lookup_driver, WatchedDriver) and lookup_driver.after_lookup(details):
+                    print(f"Row {idx+2}: looking it up again in the new browser")
+                    details.clear()
+                    details['browser_restarted'] = True
+                    success = lookup_func(lookup_driver, serial, pin, outcome_timeout, details)
+                    lookup_driver.after_lookup(details)
+            finally:
+                details['elapsed'] = time.time() - started
+                with phase_span(details, 'throttle'):
+                    throttle.release(details['elapsed'], details.get('outcome') is not None,
+                                     details.get('outcome'))
+        finally:
+            details['kind'] = lookup_kind(success, details)
+            details['attempts'] = retries.attempts.get(idx, 1)
+            retry_in = retries.end(item, details['kind'], details)
+        
+        if metrics is not None:
+            metrics.observe_lookup(details)
+        with outcomes_lock:
+            outcome_states[details.get('outcome') or 'unrecognised'] += 1
+        
+        if retry_in is not None:
+            print(f"Row {idx+2}: no answer from the site, trying again in {retry_in:.0f}s")
+            return None
+        if details['kind'] == LOOKUP_TRANSIENT:
+            details['dead_letter'] = True
+            print(f"Row {idx+2}: still no answer after {details['attempts']} attempts, giving up")
+        
+        return details['kind'] == LOOKUP_CLAIMED, details
+    
+    def describe_attempt(item):
+        attempt = retries.attempts.get(item[0], 0) + 1
+        return f" (attempt {attempt})" if attempt > 1 else ""
+    
+    try:
+        # Even a single session runs on its own thread, so reading rows ahead and
+        # saving results never hold up the browser
+        for entry in _lookup_in_pool(driver, items, max(1, workers), open_session, close_session, lookup,
+                                     retries, describe_attempt):
+            item, success, details = entry
+            if success is not None and on_result is not None:
+                on_result(item[0], item[2], item[3], success, details)
+            yield entry
+    finally:
+        if outcome_states:
+            summary = ", ".join(f"{state}={count}" for state, count in outcome_states.most_common())
+            print(f"Result pages seen: {summary}")
+        print(f"Throttle: {throttle.describe()}")
+        print(f"Retries: {retries.describe()}")
+        if metrics is not None and metrics.phases:
+            print("Time per phase, slowest first:")
+            print(metrics.describe())
+
+def _lookup_in_pool(driver, items, workers, open_session, close_session, lookup, retries, describe_attempt):
+    """
+    Run lookups on a pool of worker threads, each with its own session.
+    
+    A feeder thread reads and plans items into a bounded queue, so the next
+    rows are ready as soon as a worker is free while only a few rows beyond
+    those being looked up are held in memory. Workers take due retries
+    ahead of new rows, and stop once the feeder has finished and no retries
+    are waiting or can still arrive. Finished items are yielded on the
+    caller's thread, which writes them out while the lookups carry on. A
+    single worker uses the given session and opens none.
+    """
+    job_queue = queue.Queue(maxsize=workers * 2)
+    done_queue = queue.Queue()
+    stop = threading.Event()
+    feed_done = threading.Event()
+    feed_errors = []
+    worker_errors = []
+    workers_left = [workers]
+    workers_lock = threading.Lock()
+    
+    def put_job(job):
+        # Block while the workers are busy, but give up if the run is stopping
+        while not stop.is_set():
+            try:
+                job_queue.put(job, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+    
+    def feed():
+        try:
+            for item in items:
+                if stop.is_set():
+                    break
+                if item is None:
+                    # No row is ready yet, but more may follow
+                    stop.wait(0.1)
+                elif item[4] is not None:
+                    done_queue.put((item, None, {}))
+                else:
+                    put_job(item)
+        except Exception as e:
+            feed_errors.append(e)
+        finally:
+            feed_done.set()
+            done_queue.put(None)
+    
+    def worker_done():
+        # With no workers left the feeder and the results loop must not wait for them
+        with workers_lock:
+            workers_left[0] -= 1
+            if not workers_left[0]:
+                stop.set()
+        done_queue.put(None)
+    
+    def worker(worker_id, worker_driver):
+        owns_driver = worker_driver is None
+        label = f"[worker {worker_id}] " if workers > 1 else ""
+        try:
+            if owns_driver:
+                print(f"[worker {worker_id}] Starting...")
+                worker_driver = open_session()
+        except Exception as e:
+            print(f"[worker {worker_id}] Could not open session: {str(e)}")
+            worker_done()
+            return
+        
+        try:
+            while not stop.is_set():
+                item = retries.pop_due()
+                if item is None:
+                    try:
+                        item = job_queue.get(timeout=0.1)
+                    except queue.Empty:
+                        # The feeder may have put its last row since the get timed out
+                        if feed_done.is_set() and retries.settled() and job_queue.empty():
+                            return
+                        continue
+                
+                idx, row, serial, pin, result = item
+                print(f"{label}Processing row {idx+2}{describe_attempt(item)}: Serial={serial}, PIN={pin}")
+                finished = lookup(worker_driver, item)
+                if finished is not None:
+                    done_queue.put((item,) + finished)
+        except Exception as e:
+            # Stop the whole run, as an error in a single loop would
+            print(f"{label}Lookups stopped by an error: {str(e)}")
+            worker_errors.append(e)
+            stop.set()
+        finally:
+            worker_done()
+            if owns_driver:
+                try:
+                    close_session(worker_driver)
+                except Exception:
+                    pass
+    
+    # The logged-in session is the first worker; the rest get their own
+    threads = []
+    for worker_id in range(1, workers + 1):
+        worker_driver = driver if worker_id == 1 else None
+        threads.append(threading.Thread(target=worker, args=(worker_id, worker_driver), daemon=True))
+    threads.append(threading.Thread(target=feed, daemon=True))
+    for thread in threads:
+        thread.start()
+    
+    try:
+        # Every worker and the feeder put a final None when they finish
+        finished_threads = 0
+        while finished_threads < len(threads):
+            try:
+                # Wait in short steps so Ctrl+C is noticed on Windows too
+                entry = done_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if entry is None:
+                finished_threads += 1
+            else:
+                yield entry
+    finally:
+        stop.set()
+    
+    if worker_errors:
+        raise worker_errors[0]
+    if feed_errors:
+        raise feed_errors[0]
+
+class ResultStore:
+    """
+    Each row's result, kept as a small code in a typed array.
+    
+    Codes are indexed by row number and each distinct result text is stored
+    once, so a row costs two bytes however wide the spreadsheet is. Rows
+    that finish out of order wait here, and nowhere else, for the rows
+    before them; their cells are not held at all but read back from the
+    spreadsheet as they are written.
+    """
+    
+    def __init__(self):
+        self._codes = array.array('H')
+        self._texts = [None]
+        self._text_codes = {}
+    
+    def set(self, idx, result):
+        """Record the result text of row idx."""
+        code = self._text_codes.get(result)
+        if code is None:
+            code = len(self._texts)
+            self._texts.append(result)
+            self._text_codes[result] = code
+        if idx >= len(self._codes):
+            # Grow geometrically, so recording row by row stays linear
+            grow = max(idx + 1 - len(self._codes), len(self._codes))
+            self._codes.frombytes(bytes(grow * self._codes.itemsize))
+        self._codes[idx] = code
+    
+    def get(self, idx):
+        """Return the result text of row idx, or None if it has not finished."""
+        if idx < len(self._codes):
+            return self._texts[self._codes[idx]]
+        return None
+    
+    def ready(self, order):
+        """
+        Take rows off the front of order for as long as they have finished.
+        
+        Args:
+            order (collections.deque): Row indices in the order the rows were
+                handed out, appended to as they are handed out
+            
+        Yields:
+            tuple: (row_index, result) in that order
+        """
+        while order:
+            result = self.get(order[0])
+            if result is None:
+                return
+            yield order.popleft(), result
+
+def parse_args(argv=None):
+    """
+    Parse the command line options.
+    
+    Args:
+        argv (list): Arguments to parse, defaults to sys.argv
+        
+    Returns:
+        argparse.Namespace: Parsed options
+    """
+    parser = argparse.ArgumentParser(
+        description="Virgin Experience voucher automation",
+        epilog="Commands that never open a browser: 'preview SHEET...' shows which rows a run would "
+               "look up and which have no readable serial/PIN, and 'report RESULTS...' rebuilds the "
+               "results CSV and HTML report from a results file. Add -h after either for its options.")
+    parser.add_argument("inputs", nargs="*", metavar="CSV",
+                        help="CSV or Excel (.xlsx) files, glob patterns or directories to process, "
+                             "all in one browser session (prompted for if omitted)")
+    parser.add_argument("--sheet", default=None,
+                        help="Worksheet to read from Excel inputs, by name or number counted from 1 "
+                             "(default: the sheet that was open when the workbook was saved)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of Chrome sessions to run in parallel (default: 1)")
+    parser.add_argument("--engine", choices=["browser", "http"], default="browser",
+                        help="Drive Chrome for every lookup, or replay the search form over HTTP "
+                             "using the browser's login (default: browser)")
+    parser.add_argument("--site-url", default=SEARCH_URL,
+                        help="URL of the voucher search page, e.g. a local stand-in for testing")
+    parser.add_argument("--throttle", choices=["adaptive", "fixed"], default="adaptive",
+                        help="Pace lookups from measured latency and errors, or pause a fixed "
+                             "one second after each lookup (default: adaptive)")
+    parser.add_argument("--min-delay", type=float, default=0.25,
+                        help="Shortest gap in seconds between lookups in each worker or tab for the "
+                             "adaptive throttle (default: 0.25)")
+    parser.add_argument("--max-delay", type=float, default=30.0,
+                        help="Longest gap in seconds the adaptive throttle backs off to (default: 30)")
+    parser.add_argument("--attempts", type=int, default=3,
+                        help="Lookups per row before giving up when the site gives no answer "
+                             "(timeouts, unrecognised pages, browser errors) (default: 3)")
+    parser.add_argument("--retry-delay", type=float, default=5.0,
+                        help="Seconds before the first retry; each further retry waits twice as long (default: 5)")
+    parser.add_argument("--shard", type=parse_shard, metavar="I/N",
+                        help="Only look up this machine's share of the rows, e.g. 2/4 on the second of "
+                             "four machines; rows keep their spreadsheet row numbers so the shard "
+                             "results can be combined with --merge")
+    parser.add_argument("--merge", action="store_true",
+                        help="Combine the results CSVs of a --shard run (given as the inputs) into one "
+                             "results CSV and report in the original row order, without any lookups")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted run, skipping rows already in its journal")
+    parser.add_argument("--ledger", default=default_ledger_path(),
+                        help="SQLite file recording every serial/PIN result across runs "
+                             "(default: voucher_ledger.sqlite3 next to this script)")
+    parser.add_argument("--recheck-after", type=float, default=7,
+                        help="Days before a serial/PIN in the ledger is looked up again (default: 7)")
+    parser.add_argument("--no-ledger", action="store_true",
+                        help="Look up every row on the site, ignoring and not updating the ledger")
+    parser.add_argument("--tabs", type=int, default=1,
+                        help="Lookups to run at once in each Chrome, each in its own tab, so one "
+                             "tab submits while another waits for the site (browser engine; default: 1)")
+    parser.add_argument("--recycle-after", type=int, default=1000,
+                        help="Restart each Chrome after this many lookups to keep its memory down, "
+                             "logging back in with the same cookies (0 = only when it stops "
+                             "responding; browser engine without --tabs; default: 1000)")
+    parser.add_argument("--max-browser-memory", type=float, default=None, metavar="MB",
+                        help="Also restart a Chrome whose processes use more than this many MB "
+                             "(needs psutil)")
+    parser.add_argument("--lean", action="store_true",
+                        help="Do the lookups in headless Chrome that skips images, fonts, media and "
+                             "third-party scripts (the login, if needed, still opens a window)")
+    parser.add_argument("--element-submit", action="store_true",
+                        help="Fill in the search form one element at a time instead of with a "
+                             "single injected script (slower; for troubleshooting)")
+    parser.add_argument("--session-file", default=default_session_path(),
+                        help="Where the login cookies are kept between runs, so you only log in "
+                             "again when they expire (default: voucher_session.json next to this script)")
+    parser.add_argument("--no-session", action="store_true",
+                        help="Always log in by hand, without reading or saving the login")
+    parser.add_argument("--no-login", action="store_true",
+                        help="Don't wait for a manual login, for sites that don't need one "
+                             "(with --engine http, Chrome is then not started at all)")
+    parser.add_argument("--output-dir", default=None,
+                        help="Directory for the results, report and journal (default: next to this script)")
+    parser.add_argument("--no-prompt", action="store_true",
+                        help="Never wait for keyboard input, for scheduled runs: fail if no input "
+                             "files are given or the saved login has expired, and don't open the report")
+    parser.add_argument("--no-open", action="store_true",
+                        help="Don't open the HTML report in a browser when finished")
+    parser.add_argument("--metrics-interval", type=float, default=None,
+                        help="Also rewrite the timing metrics files every this many seconds "
+                             "during the run, not just at the end")
+    parser.add_argument("--outcome-timeout", type=float, default=OUTCOME_TIMEOUT,
+                        help=f"Seconds to wait for the result page after each lookup (default: {OUTCOME_TIMEOUT})")
+    return parser.parse_args(argv)
+
+class ResultJournal:
+    """
+    Append-only record of finished lookups, so a crashed or interrupted run
+    can be resumed without repeating them.
+    
+    Each line is a JSON object. The first line describes the input file and
+    every following line records one looked-up row. Lines are flushed and
+    fsync'd in batches to keep the cost per lookup low, and a background
+    thread syncs stragglers so no record waits longer than sync_interval
+    even when the lookups stall.
+    """
+    
+    def __init__(self, path, sync_every=20, sync_interval=2.0):
+        """
+        Args:
+            path (str): Path to the journal file
+            sync_every (int): Records to buffer before forcing them to disk
+            sync_interval (float): Longest time in seconds a record stays unsynced
+        """
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+    
+    def open(self, input_file, resume=False):
+        """
+        Open the journal for writing.
+        
+        Args:
+            input_file (str): Path to the CSV file being processed
+            resume (bool): Keep the existing records instead of starting over
+            
+        Returns:
+            dict: Mapping of row index to the records already in the journal
+        """
+        finished = {}
+        if resume and os.path.exists(self.path):
+            finished = read_journal(self.path, input_file)
+            # A torn last line from a crash is cut off, so new records start on a line of their own
+            with open(self.path, 'r+b') as file:
+                end = file.seek(0, os.SEEK_END)
+                keep = end
+                while keep:
+                    start = max(0, keep - 4096)
+                    file.seek(start)
+                    newline = file.read(keep - start).rfind(b"\n")
+                    if newline >= 0:
+                        keep = start + newline + 1
+                        break
+                    keep = start
+                if keep < end:
+                    file.truncate(keep)
+            self._file = open(self.path, 'a', encoding='utf-8')
+        else:
+            if os.path.exists(self.path):
+                # Keep the previous journal rather than silently discarding it
+                previous_path = self.path + ".prev"
+                os.replace(self.path, previous_path)
+                print(f"Previous journal moved to {previous_path} (use --resume to continue a run)")
+            self._file = open(self.path, 'w', encoding='utf-8')
+            self._write({"input": os.path.basename(input_file.strip('"\'')),
+                         "started": datetime.datetime.now().isoformat(timespec='seconds')})
+            self.sync()
+        self._closed.clear()
+        threading.Thread(target=self._sync_in_background, daemon=True).start()
+        return finished
+    
+    def _sync_in_background(self):
+        while not self._closed.wait(self.sync_interval / 2):
+            with self._lock:
+                if (self._file is not None and self._unsynced
+                        and time.monotonic() - self._last_sync >= self.sync_interval):
+                    self._sync()
+    
+    def _write(self, record):
+        self._file.write(json.dumps(record) + "\n")
+        self._unsynced += 1
+    
+    def record(self, idx, serial, pin, result, outcome=None, seconds=None):
+        """
+        Append the result of one lookup.
+        
+        Args:
+            idx (int): Index of the row in the input file
+            serial (str): Serial number that was looked up
+            pin (str): PIN that was looked up
+            result (str): Value for the Result column
+            outcome (str): Page state the lookup ended on
+            seconds (float): How long the lookup took
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            self._write({"row": idx, "serial": serial, "pin": pin, "result": result, "outcome": outcome,
+                         "seconds": round(seconds, 3) if seconds is not None else None})
+            if (self._unsynced >= self.sync_every
+                    or time.monotonic() - self._last_sync >= self.sync_interval):
+                self._sync()
+    
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+    
+    def sync(self):
+        """Force every record written so far to disk."""
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+    
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+
+def journal_path_for(input_file, output_dir=None, shard=None):
+    """
+    Work out where the journal for an input file is kept.
+    
+    Args:
+        input_file (str): Path to the input CSV file
+        output_dir (str): Directory of the results files, defaults to the script directory
+        shard (tuple): (index, count) of a --shard run, which keeps its own journal
+        
+    Returns:
+        str: Path to the journal, next to the results files
+    """
+    input_filename = os.path.basename(input_file.strip('"\''))
+    journal_filename = os.path.splitext(input_filename)[0] + shard_tag(shard) + "_journal.jsonl"
+    return os.path.join(output_dir or os.path.dirname(os.path.abspath(__file__)), journal_filename)
+
+def read_journal(path, input_file=None):
+    """
+    Read the finished lookups from a journal.
+    
+    A torn last line from a crash mid-write is ignored. Later records for a
+    row replace earlier ones.
+    
+    Args:
+        path (str): Path to the journal file
+        input_file (str): Input file the journal is expected to belong to
+        
+    Returns:
+        dict: Mapping of row index to its record
+    """
+    finished = {}
+    with open(path, 'r', encoding='utf-8') as file:
+        for line_number, line in enumerate(file, 1):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                print(f"Ignoring incomplete journal line {line_number} in {path}")
+                continue
+            
+            if "row" in record:
+                finished[record["row"]] = record
+            elif input_file and record.get("input") != os.path.basename(input_file.strip('"\'')):
+                print(f"Warning: journal {path} was written for {record.get('input')}")
+    return finished
+
+class VoucherLedger:
+    """
+    Local SQLite record of every lookup outcome, keyed on the normalised
+    serial/PIN pair, so vouchers seen in this or an earlier sheet are not
+    looked up on the site again until their result is stale.
+    """
+    
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Path to the SQLite database, created if missing
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS lookups ("
+            " serial TEXT NOT NULL,"
+            " pin TEXT NOT NULL,"
+            " result TEXT NOT NULL,"
+            " outcome TEXT,"
+            " checked_at REAL NOT NULL,"
+            " source TEXT,"
+            " PRIMARY KEY (serial, pin))"
+        )
+        self._connection.commit()
+    
+    @staticmethod
+    def normalise(serial, pin):
+        return serial.strip().upper(), pin.strip().upper()
+    
+    def get(self, serial, pin, max_age=None):
+        """
+        Look up the last recorded result for a serial/PIN pair.
+        
+        Args:
+            serial (str): Serial number
+            pin (str): PIN
+            max_age (float): Ignore results older than this many seconds
+            
+        Returns:
+            tuple: (result, checked_at) or None if there is no fresh result
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT result, checked_at FROM lookups WHERE serial = ? AND pin = ?",
+                self.normalise(serial, pin)
+            ).fetchone()
+        if row is None or (max_age is not None and time.time() - row[1] > max_age):
+            return None
+        return row
+    
+    def record(self, serial, pin, result, outcome=None, source=None):
+        """
+        Store the result of a lookup, replacing any earlier one.
+        
+        Args:
+            serial (str): Serial number
+            pin (str): PIN
+            result (str): Value of the Result column
+            outcome (str): Page state the lookup ended on
+            source (str): Name of the input file the pair came from
+        """
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO lookups (serial, pin, result, outcome, checked_at, source)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                self.normalise(serial, pin) + (result, outcome, time.time(), source)
+            )
+            self._connection.commit()
+    
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+def default_ledger_path():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "voucher_ledger.sqlite3")
+
+def default_session_path():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "voucher_session.json")
+
+def load_saved_login(path):
+    """
+    Read a login saved by save_login.
+    
+    Args:
+        path (str): Saved login file
         
-        print(f"Found {len(data)} rows in the CSV file.")
+    Returns:
+        dict: 'cookies' and 'user_agent', or None if there is no usable
+            login saved for the current search page
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            saved = json.load(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Could not read the saved login {path}: {str(e)}")
+        return None
+    
+    if saved.get("site") != SEARCH_URL:
+        return None
+    
+    # Drop cookies that have run out since they were saved
+    now = time.time()
+    cookies = [cookie for cookie in saved.get("cookies", []) if cookie.get("expiry", now + 1) > now]
+    if not cookies:
+        return None
+    return {"cookies": cookies, "user_agent": saved.get("user_agent")}
+
+def save_login(path, cookies, user_agent=None):
+    """
+    Save login cookies so the next run can skip the manual login.
+    
+    Args:
+        path (str): Saved login file
+        cookies (list): Cookie dicts as returned by driver.get_cookies()
+        user_agent (str): User agent of the browser that logged in
+    """
+    saved = {
+        "site": SEARCH_URL,
+        "saved_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "user_agent": user_agent,
+        "cookies": cookies,
+    }
+    temp_path = path + ".tmp"
+    try:
+        # The cookies are as good as a password, so keep the file private (the
+        # mode only applies on macOS and Linux; Windows uses the folder's permissions)
+        descriptor = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as file:
+            json.dump(saved, file, indent=2)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"Could not save the login to {path}: {str(e)}")
+
+def plan_rows(rows, journal_records=None, ledger=None, recheck_after=None, quiet=False):
+    """
+    Work out what to do with each row as it is read.
+    
+    Args:
+        rows (iterable): Rows from iter_input_rows
+        journal_records (dict): Records from an earlier run's journal; rows
+            already looked up there for the same serial/PIN reuse that result
+        ledger (VoucherLedger): Results from earlier lookups of the same pair
+        recheck_after (float): Seconds after which a ledger result is stale
+        quiet (bool): Don't report skipped and unreadable rows one by one
+            (where reading stops is still reported)
         
-        # Launch a new Chrome session directly
-        print("\n=== LAUNCHING NEW CHROME SESSION ===")
-        print("The script will start a new Chrome browser.\n")
+    Yields:
+        tuple: (row_index, row, serial, pin, result) where result is None if
+            the row still needs a lookup
+    """
+    journal_records = journal_records or {}
+    for idx, row in enumerate(rows):
+        # Check if the row is completely empty or has no meaningful data
+        is_empty_row = True
+        for key, value in row.items():
+            if value and value.strip():
+                is_empty_row = False
+                break
         
-        # Set up Chrome options
-        from selenium.webdriver.chrome.options import Options
-        chrome_options = Options()
+        # If we encounter a completely empty row, stop processing
+        if is_empty_row:
+            print(f"Encountered empty row at {idx+2}. Stopping processing.")
+            break
         
-        # Add some options to make Chrome more stable
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_argument("--window-size=1920,1080")
+        # Get the info text from the Info column
+        info_text = row.get('Info', '')
         
-        try:
-            # Use the ChromeDriver in the current directory
-            from selenium.webdriver.chrome.service import Service
-            chrome_driver_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chromedriver.exe")
-            print(f"Using ChromeDriver at: {chrome_driver_path}")
-            
-            # Create a Service object
-            service = Service(executable_path=chrome_driver_path)
-            
-            # Initialize Chrome with the service and options
-            print("Initializing Chrome...")
-            driver = webdriver.Chrome(service=service, options=chrome_options)
+        # Skip rows that are already processed (have "Claimed" in Status column)
+        if row.get('Satus') == 'Claimed':
+            if not quiet:
+                print(f"Skipping already claimed voucher at row {idx+2}")
+            yield idx, row, None, None, 'Claimed'
+            continue
+        
+        # Extract serial and PIN from the Info column
+        serial, pin = extract_serial_pin(info_text)
+        
+        if serial and pin:
+            # Only trust journal records made for the same serial/PIN in that row,
+            # and give rows that never got an answer another try
+            record = journal_records.get(idx)
+            if (record and (record.get("serial"), record.get("pin")) == (serial, pin)
+                    and not record["result"].startswith(DEAD_LETTER_RESULT)):
+                yield idx, row, serial, pin, record["result"]
+                continue
             
-            # Navigate to the website
-            print("Navigating to the Acorne SVS website...")
-            driver.get("https://www.acornesvs.co.uk/vouchers/search.aspx")
+            # Pairs already checked recently, in this sheet or an earlier one, aren't looked up again
+            known = ledger.get(serial, pin, recheck_after) if ledger is not None else None
+            if known:
+                checked_at = datetime.datetime.fromtimestamp(known[1]).strftime("%Y-%m-%d %H:%M")
+                print(f"Row {idx+2}: {serial} {pin} already checked on {checked_at} ({known[0]}), skipping lookup")
+                yield idx, row, serial, pin, known[0]
+            else:
+                yield idx, row, serial, pin, None
+        else:
+            # If the Info column is empty or contains only whitespace, consider it an empty row
+            if not info_text or not info_text.strip():
+                print(f"Encountered row with empty Info column at {idx+2}. Stopping processing.")
+                break
             
-            # Check if we're connected
-            current_url = driver.current_url
-            print(f"Successfully connected to Chrome! Current URL: {current_url}")
+            if not quiet:
+                print(f"Could not extract serial and PIN from row {idx+2}: {info_text}")
+            yield idx, row, serial, pin, 'Error - Could not extract serial and PIN'
+
+def parse_shard(text):
+    """
+    Parse a --shard value such as "2/4" (the second of four shards).
+    
+    Returns:
+        tuple: (index, count), with index counted from 1
+    """
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, e.g. 2/4, not {text!r}")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"shard {index} is not between 1 and {count}")
+    return index, count
+
+def shard_tag(shard):
+    """File name tag for a shard's outputs, e.g. "_shard2of4" ("" when not sharding)."""
+    return f"_shard{shard[0]}of{shard[1]}" if shard else ""
+
+def shard_of(item, count):
+    """
+    Work out which shard a planned row belongs to.
+    
+    The key is the normalised serial/PIN, or the row's cells when no pair
+    could be extracted, so every machine assigns rows the same way whatever
+    order it reads them in, and repeats of a voucher land on the same machine
+    (where the ledger saves the second lookup).
+    
+    Args:
+        item (tuple): (row_index, row, serial, pin, result) from plan_rows
+        count (int): Number of shards
+        
+    Returns:
+        int: Shard index, counted from 1
+    """
+    idx, row, serial, pin, result = item
+    if serial and pin:
+        key = "/".join(VoucherLedger.normalise(serial, pin))
+    else:
+        key = "\x1f".join(str(value or "").strip() for value in row.values())
+    return zlib.crc32(key.encode("utf-8")) % count + 1
+
+def shard_rows(items, shard):
+    """
+    Keep only the planned rows belonging to one shard.
+    
+    Args:
+        items (iterable): Tuples from plan_rows, with their original row indices
+        shard (tuple): (index, count) of this shard
+        
+    Yields:
+        tuple: The rows of this shard, unchanged
+    """
+    index, count = shard
+    for item in items:
+        if shard_of(item, count) == index:
+            yield item
+
+def launch_browser(wait_for_login=True, lean=False, session_file=None, interactive=True):
+    """
+    Launch Chrome on the search page and wait for the user to log in.
+    
+    A login saved in session_file is tried first, and the user is only asked
+    to log in if there is none or it has expired. A fresh login is saved
+    there for the next run.
+    
+    Args:
+        wait_for_login (bool): Prompt and wait for the user to log in
+        lean (bool): Hand the session to a lean headless Chrome for the
+            lookups (the login itself happens in a normal window)
+        session_file (str): Where the login is saved between runs, or None
+            to always log in by hand
+        interactive (bool): Whether someone is there to log in; if not, a
+            missing or expired saved login is an error
+        
+    Returns:
+        WebDriver: Logged-in Selenium WebDriver instance, or None if Chrome
+            could not be started or no login was available
+    """
+    # Launch a new Chrome session directly
+    print("\n=== LAUNCHING NEW CHROME SESSION ===")
+    print("The script will start a new Chrome browser.\n")
+    
+    saved = load_saved_login(session_file) if wait_for_login and session_file else None
+    driver = None
+    try:
+        if saved is not None:
+            # Try the saved login first, in the browser the lookups will use
+            driver = create_chrome_driver(lean=lean)
+            print("Restoring the saved login...")
+            add_login_cookies(driver, saved["cookies"])
+            if is_logged_in(driver):
+                print(f"Logged in with the saved session from {session_file}")
+                return driver
             
-        except Exception as e:
-            print(f"\nError launching Chrome: {str(e)}")
-            print("\nDetailed error information:")
-            import traceback
-            traceback.print_exc()
-            print("\nExiting...")
-            return
+            print("The saved login has expired.")
+            if lean or not interactive:
+                # A headless browser can't be logged into by hand
+                driver.quit()
+                driver = None
         
+        if wait_for_login and not interactive:
+            print("No usable saved login, and --no-prompt is set. "
+                  "Run once without --no-prompt to log in and save the session.")
+            return None
+        
+        if driver is None:
+            driver = create_chrome_driver(lean=lean and not wait_for_login)
+        
+        # Navigate to the website
+        print("Navigating to the Acorne SVS website...")
+        driver.get(SEARCH_URL)
+        
+        # Check if we're connected
+        current_url = driver.current_url
+        print(f"Successfully connected to Chrome! Current URL: {current_url}")
+        
+    except Exception as e:
+        print(f"\nError launching Chrome: {str(e)}")
+        print("\nDetailed error information:")
+        import traceback
+        traceback.print_exc()
+        print("\nExiting...")
+        if driver is not None:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+        return None
+    
+    if wait_for_login:
         print("Please log in to the website if needed.")
         input("Press Enter once you are logged in and on the voucher search page...")
         
-        # Process each row
-        results = []
-        for idx, row in enumerate(data):
-            # Check if the row is completely empty or has no meaningful data
-            is_empty_row = True
-            for key, value in row.items():
-                if value and value.strip():
-                    is_empty_row = False
-                    break
+        if session_file:
+            if is_logged_in(driver):
+                save_login(session_file, driver.get_cookies(), driver.execute_script("return navigator.userAgent"))
+                print(f"Login saved to {session_file} for the next run.")
+            else:
+                print("Warning: the voucher search form isn't showing, so the login was not saved.")
+        
+        if lean:
+            # Carry the login over to a headless browser and close the window
+            try:
+                lean_driver = create_chrome_driver(lean=True)
+                share_login_cookies(driver, lean_driver)
+            except Exception as e:
+                print(f"Could not start lean Chrome, carrying on in this window: {str(e)}")
+                return driver
+            driver.quit()
+            driver = lean_driver
+    return driver
+
+def restore_http_login(session_file):
+    """
+    Check whether a saved login still works for the HTTP engine, so Chrome
+    doesn't need to be started at all.
+    
+    Args:
+        session_file (str): Where the login is saved between runs
+        
+    Returns:
+        dict: The saved 'cookies' and 'user_agent', or None if there is no
+            saved login or the site no longer accepts it
+    """
+    saved = load_saved_login(session_file) if session_file else None
+    if saved is None:
+        return None
+    
+    from voucher_http_engine import HttpVoucherSession
+    session = HttpVoucherSession(SEARCH_URL, saved["cookies"], saved["user_agent"])
+    try:
+        session.open_search_page()
+    except Exception as e:
+        print(f"The saved login has expired ({str(e)}).")
+        return None
+    finally:
+        session.quit()
+    print(f"Logged in with the saved session from {session_file}")
+    return saved
+
+# Default input file when the path prompt is left empty
+DEFAULT_CSV_FILE = "P6 VExperience 22.02-10.03.25.csv"
+
+def expand_inputs(inputs, shard_results=False):
+    """
+    Turn the input arguments into a list of spreadsheet files.
+    
+    Args:
+        inputs (list): File paths, glob patterns (e.g. "weekly/*.csv") or
+            directories (every CSV or Excel file directly inside them)
+        shard_results (bool): Look for --shard results files to merge
+            instead of spreadsheets
+        
+    Returns:
+        tuple: (files, missing) where files is the files to process in
+            order, without duplicates, and missing is the arguments that
+            matched nothing
+    """
+    files = []
+    missing = []
+    for argument in inputs:
+        path = argument.strip('"\'')
+        if os.path.isdir(path) and shard_results:
+            matches = sorted(glob.glob(os.path.join(path, "*_shard*_results_*.csv")))
+        elif os.path.isdir(path):
+            matches = sorted(match for match in glob.glob(os.path.join(path, "*")) if is_input_file(match))
+        elif os.path.isfile(path):
+            matches = [path]
+        else:
+            matches = sorted(match for match in glob.glob(path) if os.path.isfile(match))
+        
+        # Directories and patterns shouldn't pick up this script's own output
+        if (len(matches) > 1 or os.path.isdir(path)) and not shard_results:
+            matches = [match for match in matches if not is_output_file(match)]
+        if not matches:
+            missing.append(argument)
+        for match in matches:
+            if os.path.abspath(match) not in (os.path.abspath(existing) for existing in files):
+                files.append(match)
+    return files, missing
+
+def is_input_file(path):
+    """Check whether a file looks like a spreadsheet to process (not an Excel lock file)."""
+    name = os.path.basename(path)
+    return os.path.splitext(name)[1].lower() in INPUT_EXTENSIONS and not name.startswith("~$")
+
+def is_output_file(path):
+    """Check whether a CSV file is one of this script's results or dead-letter files."""
+    name = os.path.basename(path)
+    return "_results_" in name or name.endswith("_dead_letters.csv")
+
+class LookupSession:
+    """
+    The logged-in session shared by every file in a run.
+    
+    Chrome (or the HTTP session) is only started when the first row that
+    needs a lookup is reached, and then reused for every later file, so a
+    batch of spreadsheets costs one startup and at most one login. The
+    sessions of further workers are kept for the next file in the same way.
+    The throttle is shared too, so the pace learned on one file carries over.
+    
+    With --tabs, each Chrome runs that many lookups at once in its own tabs,
+    and session and open_session hand out tabs rather than browsers.
+    """
+    
+    def __init__(self, args):
+        """
+        Args:
+            args (argparse.Namespace): Parsed command line options
+        """
+        self.args = args
+        self.session_file = None if args.no_session else args.session_file
+        self.tabs = args.tabs if args.engine == "browser" else 1
+        self.concurrency = args.workers * self.tabs
+        self.session = None
+        self.open_session = None
+        self.lookup_func = None
+        self.throttle = None
+        self.spare_sessions = []
+        self._spare_lock = threading.Lock()
+    
+    def start(self):
+        """
+        Log in and prepare the lookups, if not already done.
+        
+        Returns:
+            bool: False if no logged-in session could be started
+        """
+        if self.session is not None:
+            return True
+        args = self.args
+        
+        # Without a login to capture, or with a saved one that still
+        # works, the HTTP engine doesn't need Chrome at all
+        driver = None
+        saved_login = None
+        if args.engine == "http" and not args.no_login:
+            saved_login = restore_http_login(self.session_file)
+        if args.engine != "http" or not (args.no_login or saved_login):
+            driver = launch_browser(wait_for_login=not args.no_login,
+                                    lean=args.lean and args.engine == "browser",
+                                    session_file=self.session_file,
+                                    interactive=not args.no_prompt)
+            if driver is None:
+                return False
+        
+        # Choose how the lookups are made
+        self.lookup_func = process_voucher
+        if args.element_submit:
+            self.lookup_func = functools.partial(process_voucher, script_submit=False)
+        self.session = driver
+        if args.lean and args.engine == "browser":
+            def open_session():
+                new_driver = create_chrome_driver(lean=True)
+                share_login_cookies(driver, new_driver)
+                return new_driver
+            self.open_session = open_session
+        if self.tabs > 1:
+            self._use_tabs(driver)
+        elif args.engine == "browser":
+            self._watch(driver)
+        if args.engine == "http":
+            from voucher_http_engine import HttpVoucherSession, process_voucher as http_process_voucher
+            
+            # Hand the browser's login over to plain HTTP sessions and close Chrome
+            cookies = []
+            user_agent = None
+            if saved_login is not None:
+                cookies = saved_login["cookies"]
+                user_agent = saved_login["user_agent"]
+            if driver is not None:
+                cookies = driver.get_cookies()
+                user_agent = driver.execute_script("return navigator.userAgent")
+                driver.quit()
             
-            # If we encounter a completely empty row, stop processing
-            if is_empty_row:
-                print(f"Encountered empty row at {idx+2}. Stopping processing.")
+            def open_session():
+                http_session = HttpVoucherSession(SEARCH_URL, cookies, user_agent)
+                http_session.open_search_page()
+                return http_session
+            
+            self.open_session = open_session
+            self.lookup_func = http_process_voucher
+            self.session = open_session()
+        
+        if args.throttle == "fixed":
+            self.throttle = FixedThrottle()
+        else:
+            self.throttle = AdaptiveThrottle(args.min_delay, args.max_delay, max_window=self.concurrency)
+        return True
+    
+    def _watch(self, driver):
+        """Run each browser under a watchdog that replaces it when needed."""
+        args = self.args
+        
+        def reopen(cookies):
+            new_driver = create_chrome_driver(lean=args.lean)
+            add_login_cookies(new_driver, cookies)
+            if cookies and not is_logged_in(new_driver):
+                print("Warning: the new browser isn't on the voucher search form; the login may have expired.")
+            return new_driver
+        
+        def watched(new_driver):
+            return WatchedDriver(new_driver, reopen, args.recycle_after or None, args.max_browser_memory)
+        
+        # Further workers log in with the latest cookies noted from the first browser
+        self.session = watched(driver)
+        self.open_session = lambda: watched(reopen(self.session.cookies))
+        if args.max_browser_memory and importlib.util.find_spec("psutil") is None:
+            print("--max-browser-memory needs psutil (pip install psutil); browsers will only "
+                  "be restarted on schedule or when they stop responding.")
+    
+    def _use_tabs(self, driver):
+        """Hand out tabs, filling the logged-in browser before opening more browsers."""
+        open_browser = self.open_session
+        if open_browser is None:
+            def open_browser():
+                new_driver = create_chrome_driver()
+                share_login_cookies(driver, new_driver)
+                return new_driver
+        
+        browsers = [BrowserTabs(driver)]
+        browsers_lock = threading.Lock()
+        
+        def open_session():
+            with browsers_lock:
+                # Browsers whose tabs have all been closed have quit
+                browsers[:] = [browser for browser in browsers if browser.handles]
+                for browser in browsers:
+                    if len(browser.handles) < self.tabs:
+                        return browser.open_tab()
+                browser = BrowserTabs(open_browser())
+                browsers.append(browser)
+                return browser.open_tab()
+        
+        self.session = browsers[0].open_tab()
+        self.open_session = open_session
+    
+    def borrow_session(self):
+        """Hand a further worker a session, reusing one kept from an earlier file."""
+        with self._spare_lock:
+            if self.spare_sessions:
+                return self.spare_sessions.pop()
+        return self.open_session()
+    
+    def keep_session(self, session):
+        """Take back a further worker's session, for the next file's workers."""
+        with self._spare_lock:
+            self.spare_sessions.append(session)
+    
+    def close(self):
+        """Save the (possibly renewed) login and close the browsers."""
+        with self._spare_lock:
+            spare_sessions, self.spare_sessions = self.spare_sessions, []
+        for session in spare_sessions:
+            try:
+                session.quit()
+            except Exception:
+                pass
+        if self.session is None:
+            return
+        args = self.args
+        try:
+            # The site may have renewed the login cookies during the run
+            if args.engine == "browser" and self.session_file and not args.no_login and is_logged_in(self.session):
+                try:
+                    save_login(self.session_file, self.session.get_cookies(),
+                               self.session.execute_script("return navigator.userAgent"))
+                except Exception as e:
+                    print(f"Could not save the renewed login: {str(e)}")
+            if isinstance(self.session, TabDriver):
+                # Quit the whole browser, not just the first tab
+                self.session.browser.driver.quit()
+            else:
+                self.session.quit()
+        except Exception:
+            pass
+        self.session = None
+
+def process_file(csv_file, args, lookups, ledger=None):
+    """
+    Look up every row of one spreadsheet and write its results CSV, report,
+    metrics and dead-letter list.
+    
+    Args:
+        csv_file (str): Path to the input CSV or Excel file
+        args (argparse.Namespace): Parsed command line options
+        lookups (LookupSession): Shared session, started on the first lookup
+        ledger (VoucherLedger): Results from earlier runs, or None
+        
+    Returns:
+        dict: Summary of the file ('file', 'rows', 'counts', 'results',
+            'report', 'status')
+    """
+    summary = {"file": csv_file, "rows": 0, "counts": collections.Counter(),
+               "results": None, "report": None, "status": "failed"}
+    journal = None
+    csv_writer = None
+    report = None
+    metrics = None
+    rejoined = None
+    # Pairs being looked up, with the repeats in the sheet parked until the first lookup ends
+    parked = {}
+    released = collections.deque()
+    pairs = threading.Lock()
+    try:
+        # Every finished lookup goes into the journal as soon as it completes
+        opened = ResultJournal(journal_path_for(csv_file, args.output_dir, args.shard))
+        journal_records = opened.open(csv_file, resume=args.resume)
+        # Only a journal that opened has anything to resume from
+        journal = opened
+        if args.resume:
+            print(f"Resuming from {journal.path}: {len(journal_records)} lookups already done.")
+        
+        # Rows stream from the CSV file through the lookups into the output files
+        print(f"Reading input file: {csv_file}")
+        planned = plan_rows(iter_input_rows(csv_file, args.sheet), journal_records, ledger, args.recheck_after * 86400)
+        if args.shard:
+            print(f"Processing shard {args.shard[0]} of {args.shard[1]}: only this shard's rows are looked up.")
+            planned = shard_rows(planned, args.shard)
+        
+        csv_writer = ResultsCsvWriter(csv_file, args.output_dir, args.shard)
+        report = HtmlReportWriter(csv_writer.path)
+        metrics_base = os.path.splitext(csv_writer.path)[0]
+        metrics = RunMetrics(metrics_base + "_metrics.json", metrics_base + "_metrics.prom",
+                             args.metrics_interval)
+        counts = summary["counts"]
+        
+        # Rows go on to the lookups without their cells; only each row's
+        # result is kept, and the cells are read again as the row is written
+        store = ResultStore()
+        order = collections.deque()
+        rejoined = iter_input_rows(csv_file, args.sheet, quiet=True)
+        source = enumerate(rejoined)
+        
+        def handed_out(items):
+            for idx, row, serial, pin, result in items:
+                # Repeats released for a lookup of their own go ahead of new rows
+                while released:
+                    yield released.popleft()
+                order.append(idx)
+                if result is None and ledger is not None and park_repeat(idx, serial, pin):
+                    continue
+                yield idx, None, serial, pin, result
+            # The feeder keeps polling while rows wait on lookups still running
+            while True:
+                with pairs:
+                    if not released and not any(parked.values()):
+                        return
+                if released:
+                    yield released.popleft()
+                else:
+                    yield None
+        
+        def park_repeat(idx, serial, pin):
+            # Rows are planned ahead of the lookups, so a repeat of a pair still
+            # being looked up is set aside without holding up the rows after it
+            key = VoucherLedger.normalise(serial, pin)
+            with pairs:
+                if key in parked:
+                    parked[key].append((idx, None, serial, pin, None))
+                    return True
+                parked[key] = []
+                return False
+        
+        def release_repeats(item, success, details):
+            key = VoucherLedger.normalise(item[2], item[3])
+            with pairs:
+                waiting = parked.pop(key, [])
+                if waiting and details.get('outcome') is None:
+                    # The lookup got no answer worth keeping, so the next repeat gets its own
+                    released.append(waiting[0])
+                    parked[key] = waiting[1:]
+                    return
+            result = result_text(success, details)
+            for idx, row, serial, pin, _ in waiting:
+                print(f"Row {idx+2}: {serial} {pin} was just looked up for an earlier row "
+                      f"({result}), skipping lookup")
+                finish(idx, result)
+        
+        def finish(idx, result):
+            store.set(idx, result)
+            # Write every row that is now next in line, in the order handed out
+            for ready_idx, ready_result in store.ready(order):
+                for row_idx, row in source:
+                    if row_idx == ready_idx:
+                        break
+                else:
+                    raise ValueError(f"Row {ready_idx + 2} is no longer in {csv_file}; "
+                                     "was the spreadsheet changed during the run?")
+                row['Result'] = ready_result
+                if args.shard:
+                    # Shard results carry their spreadsheet row number for --merge
+                    row = {'Row': ready_idx + 2, **row}
+                csv_writer.write(row)
+                report.write(row)
+                counts[ready_result] += 1
+        
+        # Rows before the first lookup can be written without starting a browser
+        planned = handed_out(planned)
+        first_job = None
+        for item in planned:
+            if item[4] is None:
+                first_job = item
                 break
+            finish(item[0], item[4])
+        
+        if first_job is not None:
+            if not lookups.start():
+                summary["status"] = "no session"
+                return summary
             
-            # Get the info text from the Info column
-            info_text = row.get('Info', '')
+            # Process the vouchers
+            if lookups.tabs > 1:
+                print(f"\nProcessing vouchers in {lookups.tabs} tabs in each of {args.workers} Chrome sessions...")
+            elif args.workers > 1:
+                print(f"\nProcessing vouchers with {args.workers} {args.engine} sessions...")
+            retries = RetryQueue(args.attempts, args.retry_delay)
             
-            # Skip rows that are already processed (have "Claimed" in Status column)
-            if row.get('Satus') == 'Claimed':
-                print(f"Skipping already claimed voucher at row {idx+2}")
-                
-                # Add to results with existing status
-                result_row = row.copy()
-                result_row['Result'] = 'Claimed'
-                results.append(result_row)
-                continue
+            def on_result(idx, serial, pin, success, details):
+                result = result_text(success, details)
+                journal.record(idx, serial, pin, result, details.get('outcome'), details.get('elapsed'))
+                # Only results from a recognised page are worth remembering across runs
+                if ledger is not None and details.get('outcome') is not None:
+                    ledger.record(serial, pin, result, details['outcome'], os.path.basename(csv_file))
             
-            # Extract serial and PIN from the Info column
-            serial, pin = extract_serial_pin(info_text)
+            finished = lookup_vouchers(lookups.session, itertools.chain([first_job], planned),
+                                       lookups.concurrency, args.outcome_timeout, lookups.borrow_session,
+                                       lookups.lookup_func, lookups.throttle, on_result, metrics, retries,
+                                       lookups.keep_session)
+            for item, success, details in finished:
+                finish(item[0], item[4] if item[4] is not None else result_text(success, details))
+                if success is not None and ledger is not None:
+                    release_repeats(item, success, details)
             
-            if serial and pin:
-                print(f"Processing row {idx+2}: Serial={serial}, PIN={pin}")
-                
-                # Process the voucher
-                success = process_voucher(driver, serial, pin)
-                
-                # Create result row
-                result_row = row.copy()
-                if success:
-                    result_row['Result'] = 'Claimed'
+            if retries.dead_letters:
+                dead_letter_file = write_dead_letters(os.path.splitext(csv_writer.path)[0] + "_dead_letters.csv",
+                                                      retries.dead_letters,
+                                                      enumerate(iter_input_rows(csv_file, args.sheet, quiet=True)))
+                print(f"{len(retries.dead_letters)} rows never got an answer from the site; "
+                      f"they are listed in {dead_letter_file}")
+        
+        summary["rows"] = csv_writer.rows_written
+        if not csv_writer.rows_written:
+            print("No data found in the CSV file or file could not be read.")
+        else:
+            counted = ", ".join(f"{result}={count}" for result, count in counts.most_common())
+            print(f"\nProcessed {csv_writer.rows_written} rows: {counted}")
+        
+        summary["results"] = csv_writer.close()
+        summary["report"] = report.close()
+        print(f"\nResults have been saved to:")
+        print(f"1. CSV file: {summary['results']}")
+        print(f"2. HTML report: {summary['report']}")
+        if metrics.phases:
+            print(f"3. Timing metrics: {metrics.json_path} and {metrics.prom_path}")
+        summary["status"] = "done"
+        return summary
+    except KeyboardInterrupt:
+        summary["status"] = "interrupted"
+        raise
+    except Exception as e:
+        print(f"Error processing {csv_file}: {str(e)}")
+        if journal is not None:
+            print("Finished lookups are saved in the journal; run again with --resume to continue.")
+        return summary
+    finally:
+        if journal is not None:
+            journal.close()
+        if rejoined is not None:
+            rejoined.close()
+        if metrics is not None and metrics.phases:
+            try:
+                metrics.write()
+            except OSError as e:
+                print(f"Could not write the timing metrics: {str(e)}")
+        # Whatever finished is already on disk; close the files so they are complete
+        for writer in (csv_writer, report):
+            if writer is not None:
+                writer.close()
+        if summary["results"] is None and csv_writer is not None:
+            summary["results"] = csv_writer.path
+            summary["report"] = report.path if report is not None else None
+            summary["rows"] = csv_writer.rows_written
+
+def write_batch_summary(summaries, output_dir=None):
+    """
+    Print and save a combined summary of every file in a batch.
+    
+    Args:
+        summaries (list): Dicts returned by process_file
+        output_dir (str): Directory for the summary, defaults to the script directory
+        
+    Returns:
+        str: Path to the summary CSV, or None if it could not be written
+    """
+    results = sorted({result for summary in summaries for result in summary["counts"]})
+    totals = collections.Counter()
+    
+    print("\n=== BATCH SUMMARY ===")
+    for summary in summaries:
+        totals.update(summary["counts"])
+        counted = ", ".join(f"{result}={count}" for result, count in summary["counts"].most_common())
+        print(f"{os.path.basename(summary['file'])}: {summary['status']}, {summary['rows']} rows"
+              + (f" ({counted})" if counted else ""))
+    print(f"Total: {sum(summary['rows'] for summary in summaries)} rows in {len(summaries)} files"
+          + (f" ({', '.join(f'{result}={count}' for result, count in totals.most_common())})" if totals else ""))
+    
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    path = os.path.join(output_dir or os.path.dirname(os.path.abspath(__file__)), f"batch_summary_{timestamp}.csv")
+    try:
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(["File", "Status", "Rows"] + results + ["Results CSV", "HTML report"])
+            for summary in summaries:
+                writer.writerow([summary["file"], summary["status"], summary["rows"]]
+                                + [summary["counts"].get(result, 0) for result in results]
+                                + [summary["results"] or "", summary["report"] or ""])
+        print(f"Batch summary saved to: {path}")
+        return path
+    except Exception as e:
+        print(f"Could not write the batch summary: {str(e)}")
+        return None
+
+SHARD_RESULTS_PATTERN = re.compile(r'^(.*)_shard(\d+)of(\d+)_results_\d{8}_\d{6}\.csv$')
+
+def read_shard_results(path):
+    """
+    Read one shard's results CSV.
+    
+    Args:
+        path (str): Results CSV written by a --shard run
+        
+    Yields:
+        tuple: (row_number, row) in file order, without the 'Row' column
+    """
+    previous = 0
+    for row in iter_csv_rows(path):
+        try:
+            number = int(row.pop('Row'))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"{path} has no row numbers; only results from a --shard run can be merged")
+        if number <= previous:
+            raise ValueError(f"{path} is not in row order at row {number}")
+        previous = number
+        yield number, row
+
+def merge_shard_results(paths, output_dir=None):
+    """
+    Combine the results CSVs of a --shard run into one results CSV and report.
+    
+    Each shard file is already in row order, so the files are merged as
+    streams rather than read into memory. A row found in more than one file
+    is written once if the copies agree; if they don't (the same row looked
+    up with different results, or files from different spreadsheets) it is
+    written with a "Conflict" result and listed.
+    
+    Args:
+        paths (list): Results CSVs from the shards
+        output_dir (str): Directory for the output, defaults to the script directory
+        
+    Returns:
+        dict: Summary ('rows', 'counts', 'conflicts', 'missing', 'results', 'report')
+    """
+    # Check the file names say the shards belong together and none is missing
+    names = [SHARD_RESULTS_PATTERN.match(os.path.basename(path)) for path in paths]
+    stems = sorted({name.group(1) for name in names if name})
+    splits = sorted({int(name.group(3)) for name in names if name})
+    if len(stems) > 1:
+        print(f"Warning: the shard results come from different spreadsheets: {', '.join(stems)}")
+    if len(splits) > 1:
+        print(f"Warning: the shard results come from runs split different ways: "
+              f"{', '.join(f'{count} shards' for count in splits)}")
+    elif splits:
+        present = {int(name.group(2)) for name in names if name}
+        absent = [index for index in range(1, splits[0] + 1) if index not in present]
+        if absent:
+            print(f"Warning: no results given for shard {', '.join(map(str, absent))} of {splits[0]}")
+    stem = stems[0] if stems else os.path.splitext(os.path.basename(paths[0]))[0]
+    
+    # Refuse files without row numbers before any output is created
+    for path in paths:
+        encoding, dialect = sniff_csv_format(path)
+        with open(path, 'r', encoding=encoding, errors='latin1fallback', newline='') as file:
+            header = next(csv.reader(file, dialect=dialect), [])
+        if 'Row' not in header:
+            raise ValueError(f"{path} has no row numbers; only results from a --shard run can be merged")
+    
+    def numbered(order, path):
+        for number, row in read_shard_results(path):
+            yield number, order, row
+    
+    summary = {"rows": 0, "counts": collections.Counter(), "conflicts": [], "missing": 0,
+               "results": None, "report": None}
+    csv_writer = ResultsCsvWriter(stem + ".csv", output_dir)
+    report = HtmlReportWriter(csv_writer.path)
+    try:
+        expected = 2
+        merged = heapq.merge(*(numbered(order, path) for order, path in enumerate(paths)))
+        for number, copies in itertools.groupby(merged, key=lambda entry: entry[0]):
+            copies = list(copies)
+            row = copies[0][2]
+            
+            # Row numbers skipped by every shard were never looked up
+            summary["missing"] += number - expected
+            expected = number + 1
+            
+            if any(other != row for _, _, other in copies[1:]):
+                inputs = [{key: value for key, value in other.items() if key != 'Result'} for _, _, other in copies]
+                if any(other != inputs[0] for other in inputs[1:]):
+                    reason = "different spreadsheet rows"
                 else:
-                    result_row['Result'] = 'Error'
-                
-                # Add to results
-                results.append(result_row)
-                
-                # Wait a bit between vouchers to avoid overwhelming the site
-                time.sleep(1)
-            else:
-                # If the Info column is empty or contains only whitespace, consider it an empty row
-                if not info_text or not info_text.strip():
-                    print(f"Encountered row with empty Info column at {idx+2}. Stopping processing.")
-                    break
-                
-                print(f"Could not extract serial and PIN from row {idx+2}: {info_text}")
-                
-                # Add to results with error
-                result_row = row.copy()
-                result_row['Result'] = 'Error - Could not extract serial and PIN'
-                results.append(result_row)
-        
-        # Close the browser
-        driver.quit()
-        
-        # Write results to CSV
-        output_file = write_results_csv(csv_file, results)
-        
-        # Generate HTML report
-        if output_file:
-            html_file = generate_html_report(results, output_file)
-            if html_file:
-                print(f"\nResults have been saved to:")
-                print(f"1. CSV file: {output_file}")
-                print(f"2. HTML report: {html_file}")
-                
-                # Try to open the HTML report
-                try:
-                    import webbrowser
-                    webbrowser.open(f"file://{os.path.abspath(html_file)}")
-                    print("HTML report has been opened in your default browser.")
-                except:
-                    print("Could not automatically open the HTML report. Please open it manually.")
+                    reason = " / ".join(dict.fromkeys(other.get('Result') or "" for _, _, other in copies))
+                summary["conflicts"].append((number, reason, [paths[order] for _, order, _ in copies]))
+                row = dict(row, Result=f"Conflict - {reason}")
+            
+            csv_writer.write(row)
+            report.write(row)
+            summary["counts"][row.get('Result')] += 1
+    finally:
+        summary["rows"] = csv_writer.rows_written
+        summary["results"] = csv_writer.close()
+        summary["report"] = report.close()
+    
+    for number, reason, files in summary["conflicts"][:20]:
+        print(f"Conflict at row {number}: {reason} ({', '.join(os.path.basename(path) for path in files)})")
+    if len(summary["conflicts"]) > 20:
+        print(f"... and {len(summary['conflicts']) - 20} more conflicts")
+    if summary["missing"]:
+        print(f"Warning: {summary['missing']} rows are in none of the shard results")
+    counted = ", ".join(f"{result}={count}" for result, count in summary["counts"].most_common())
+    print(f"\nMerged {summary['rows']} rows from {len(paths)} files" + (f": {counted}" if counted else ""))
+    print(f"1. CSV file: {summary['results']}")
+    print(f"2. HTML report: {summary['report']}")
+    return summary
+
+def preview_main(argv=None):
+    """
+    The preview command: show what a run would do with each spreadsheet,
+    without opening a browser or looking anything up.
+    
+    Args:
+        argv (list): Arguments after "preview"
         
-        print("\nVoucher automation completed successfully!")
+    Returns:
+        int: Exit status, non-zero if a file could not be read
+    """
+    parser = argparse.ArgumentParser(prog="voucher_automation_simple.py preview",
+                                     description="Dry-run the serial/PIN extraction over spreadsheets")
+    parser.add_argument("inputs", nargs="+", metavar="CSV",
+                        help="CSV or Excel files, glob patterns or directories to preview")
+    parser.add_argument("--sheet", default=None,
+                        help="Worksheet to read from Excel inputs, by name or number counted from 1")
+    parser.add_argument("--show", type=int, default=20,
+                        help="Rows without a serial/PIN to list per file (default: 20)")
+    args = parser.parse_args(argv)
+    
+    files, missing = expand_inputs(args.inputs)
+    for argument in missing:
+        print(f"Error reading CSV file: {argument} does not exist.")
+    status = 1 if missing or not files else 0
+    
+    for input_file in files:
+        print(f"\n=== PREVIEW: {input_file} ===")
+        started = time.perf_counter()
+        counts = collections.Counter()
+        pairs = set()
+        failures = []
+        try:
+            for idx, row, serial, pin, result in plan_rows(iter_input_rows(input_file, args.sheet), quiet=True):
+                counts["rows"] += 1
+                if result == 'Claimed':
+                    counts["claimed"] += 1
+                elif result is not None:
+                    counts["failed"] += 1
+                    if len(failures) < args.show:
+                        failures.append((idx, row.get('Info', '')))
+                else:
+                    pair = VoucherLedger.normalise(serial, pin)
+                    counts["repeated" if pair in pairs else "lookups"] += 1
+                    pairs.add(pair)
+        except Exception as e:
+            print(f"Error reading {input_file}: {str(e)}")
+            status = 1
+            continue
+        elapsed = time.perf_counter() - started
+        
+        print(f"Rows read:          {counts['rows']} in {elapsed:.2f}s")
+        print(f"To look up:         {counts['lookups']}")
+        print(f"Repeated pairs:     {counts['repeated']} (same serial/PIN as an earlier row)")
+        print(f"Already claimed:    {counts['claimed']}")
+        print(f"No serial/PIN:      {counts['failed']}")
+        for idx, info_text in failures:
+            print(f"  Row {idx+2}: {info_text!r}")
+        if counts["failed"] > len(failures):
+            print(f"  ... and {counts['failed'] - len(failures)} more")
+    return status
+
+RESULTS_SUFFIX_PATTERN = re.compile(r'_results_\d{8}_\d{6}$')
+
+def report_main(argv=None):
+    """
+    The report command: rebuild the results CSV and HTML report from an
+    existing results file, without opening a browser.
+    
+    Args:
+        argv (list): Arguments after "report"
+        
+    Returns:
+        int: Exit status, non-zero if a file could not be rebuilt
+    """
+    parser = argparse.ArgumentParser(prog="voucher_automation_simple.py report",
+                                     description="Rebuild the results CSV and HTML report from results files")
+    parser.add_argument("inputs", nargs="+", metavar="RESULTS",
+                        help="Results CSV files (<name>_results_<timestamp>.csv) to rebuild")
+    parser.add_argument("--output-dir", default=None,
+                        help="Directory for the new files (default: next to this script)")
+    parser.add_argument("--open", action="store_true",
+                        help="Open the rebuilt HTML report in a browser (one file only)")
+    args = parser.parse_args(argv)
+    if args.output_dir:
+        try:
+            os.makedirs(args.output_dir, exist_ok=True)
+        except OSError as e:
+            print(f"Could not create the output directory {args.output_dir}: {str(e)}")
+            return 1
+    
+    status = 0
+    reports = []
+    for argument in args.inputs:
+        path = argument.strip('"\'')
+        if not os.path.isfile(path):
+            print(f"Error reading CSV file: {argument} does not exist.")
+            status = 1
+            continue
+        
+        # Name the new files after the original spreadsheet, as a run would
+        stem = RESULTS_SUFFIX_PATTERN.sub("", os.path.splitext(os.path.basename(path))[0])
+        csv_writer = None
+        report = None
+        counts = collections.Counter()
+        try:
+            rows = iter_input_rows(path)
+            first = next(rows, None)
+            if first is None or 'Result' not in first:
+                raise ValueError("it has no Result column")
+            csv_writer = ResultsCsvWriter(stem + ".csv", args.output_dir)
+            report = HtmlReportWriter(csv_writer.path)
+            # A shard's rows are already in row order, so drop its Row column as --merge does
+            shard_results = SHARD_RESULTS_PATTERN.match(os.path.basename(path)) is not None
+            for row in itertools.chain([first], rows):
+                if shard_results:
+                    row.pop('Row', None)
+                csv_writer.write(row)
+                report.write(row)
+                counts[row.get('Result')] += 1
+        except Exception as e:
+            print(f"Could not rebuild the report from {path}: {str(e)}")
+            status = 1
+        finally:
+            for writer in (csv_writer, report):
+                if writer is not None:
+                    writer.close()
+        if report is not None:
+            counted = ", ".join(f"{result}={count}" for result, count in counts.most_common())
+            print(f"Rebuilt {csv_writer.rows_written} rows" + (f": {counted}" if counted else ""))
+            reports.append(report.path)
+    
+    if args.open and len(reports) == 1:
+        import webbrowser
+        webbrowser.open(f"file://{os.path.abspath(reports[0])}")
+    return status
+
+def main(argv=None):
+    """
+    Main function to run the voucher automation process.
+    """
+    global SEARCH_URL
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] == "preview":
+        return preview_main(argv[1:])
+    if argv and argv[0] == "report":
+        return report_main(argv[1:])
+    
+    args = parse_args(argv)
+    SEARCH_URL = args.site_url
+    if args.output_dir:
+        try:
+            os.makedirs(args.output_dir, exist_ok=True)
+        except OSError as e:
+            print(f"Could not create the output directory {args.output_dir}: {str(e)}")
+            return 1
+    
+    # Get the CSV file path from the user
+    inputs = args.inputs
+    if args.merge:
+        shard_files, missing = expand_inputs(inputs, shard_results=True)
+        for argument in missing:
+            print(f"Error reading CSV file: {argument} does not exist.")
+        if not shard_files:
+            print("No shard results to merge.")
+            return 1
+        try:
+            merged = merge_shard_results(shard_files, args.output_dir)
+        except (OSError, ValueError) as e:
+            print(f"Could not merge the shard results: {str(e)}")
+            return 1
+        return 1 if missing or merged["conflicts"] or merged["missing"] else 0
+    if not inputs:
+        if args.no_prompt:
+            print("No input files given.")
+            return 1
+        csv_file = input(f"Enter the path to the CSV file (default: {DEFAULT_CSV_FILE}): ")
+        inputs = [csv_file or DEFAULT_CSV_FILE]
+    
+    csv_files, missing = expand_inputs(inputs)
+    for argument in missing:
+        print(f"Error reading CSV file: {argument} does not exist.")
+    if not csv_files:
+        print("No data found in the CSV file or file could not be read.")
+        return 1
+    
+    # Print the file paths for debugging
+    for csv_file in csv_files:
+        print(f"Using file path: {csv_file}")
+    
+    ledger = None
+    lookups = LookupSession(args)
+    summaries = []
+    try:
+        if not args.no_ledger:
+            ledger = VoucherLedger(args.ledger)
+        
+        for number, csv_file in enumerate(csv_files, 1):
+            if len(csv_files) > 1:
+                print(f"\n=== FILE {number} OF {len(csv_files)}: {csv_file} ===")
+            summaries.append(process_file(csv_file, args, lookups, ledger))
+            if summaries[-1]["status"] == "no session":
+                break
         
+    except KeyboardInterrupt:
+        print("\nInterrupted. Finished lookups are saved in the journal; "
+              "run again with --resume to continue where this run stopped.")
+        return 130
     except Exception as e:
         print(f"Error in main process: {str(e)}")
+        return 1
+    finally:
+        if ledger is not None:
+            ledger.close()
+        lookups.close()
+        if len(csv_files) > 1 and summaries:
+            write_batch_summary(summaries, args.output_dir)
+    
+    # Try to open the HTML report (one file only; a batch would open a tab per file)
+    if len(csv_files) == 1 and summaries[0]["report"] and not args.no_open and not args.no_prompt:
+        try:
+            import webbrowser
+            webbrowser.open(f"file://{os.path.abspath(summaries[0]['report'])}")
+            print("HTML report has been opened in your default browser.")
+        except:
+            print("Could not automatically open the HTML report. Please open it manually.")
+    
+    if not missing and len(summaries) == len(csv_files) and all(summary["status"] == "done" for summary in summaries):
+        print("\nVoucher automation completed successfully!")
+        return 0
+    return 1
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,499 @@
+"""
+Browserless engine for the Acorne SVS voucher search.
+
+The search page is a plain ASP.NET form, so a lookup can be replayed as a
+form postback over a keep-alive HTTP connection instead of being driven
+through Chrome. The hidden __VIEWSTATE / __EVENTVALIDATION fields are carried
+from each response into the next request, the login cookies are imported from
+a browser session, and the result page is classified by parsing the HTML
+against the same XPaths the Selenium engine uses.
+"""
+import gzip
+import http.client
+import re
+import time
+import zlib
+from html.parser import HTMLParser
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urljoin, urlsplit
+
+from voucher_automation_simple import (
+    SEARCH_URL,
+    ERROR_MESSAGE_XPATH,
+    CLAIM_BUTTON_XPATH,
+    CLAIM_ABANDON_XPATH,
+    SUCCESS_ABANDON_XPATH,
+    OUTCOME_INVALID,
+    OUTCOME_CLAIM_PAGE,
+    OUTCOME_SUCCESS_PAGE,
+    OUTCOME_GENERIC_ABANDON,
+    OUTCOME_TIMEOUT,
+    phase_span,
+)
+
+# Element IDs on the search form
+SERIAL_INPUT_ID = "ctl00_cphMain_tbxSerialNo"
+PIN_INPUT_ID = "ctl00_cphMain_tbxPinNo"
+LOOKUP_BUTTON_ID = "ctl00_cphMain_btnLookup"
+
+# Elements that never have a closing tag
+VOID_ELEMENTS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr",
+}
+
+# Input types that are only submitted when they are the control that was clicked
+BUTTON_INPUT_TYPES = {"submit", "button", "image", "reset"}
+
+DO_POSTBACK_PATTERN = re.compile(r"__doPostBack\(\s*'([^']*)'\s*,\s*'([^']*)'\s*\)")
+
+class HttpEngineError(Exception):
+    """Raised when the site returns something the engine cannot work with."""
+
+class PageElement:
+    """An element of a parsed page, with its position as XPath-style steps."""
+    
+    __slots__ = ("tag", "attrs", "path", "text")
+    
+    def __init__(self, tag, attrs, path):
+        self.tag = tag
+        self.attrs = attrs
+        self.path = path
+        self.text = ""
+    
+    def matches(self, xpath_steps):
+        """Check whether this element sits at the given absolute XPath."""
+        if len(xpath_steps) != len(self.path):
+            return False
+        for (tag, index), (own_tag, own_index) in zip(xpath_steps, self.path):
+            if tag != own_tag or (index is not None and index != own_index):
+                return False
+        return True
+
+class PageParser(HTMLParser):
+    """
+    Collect the elements of a page along with their absolute positions,
+    numbered the same way a browser's DOM would number them.
+    """
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.elements = []
+        self.forms = []
+        # Stack of [tag, index, child tag counters] for the open elements
+        self._stack = [["#document", 1, {}]]
+        self._open_anchors = []
+    
+    def _path(self):
+        return tuple((tag, index) for tag, index, _ in self._stack[1:])
+    
+    def _push(self, tag):
+        counters = self._stack[-1][2]
+        counters[tag] = counters.get(tag, 0) + 1
+        self._stack.append([tag, counters[tag], {}])
+    
+    def handle_starttag(self, tag, attrs):
+        # Browsers wrap table rows in an implicit tbody
+        if tag == "tr" and self._stack[-1][0] == "table":
+            self._push("tbody")
+        
+        attrs = {name: (value if value is not None else "") for name, value in attrs}
+        counters = self._stack[-1][2]
+        index = counters.get(tag, 0) + 1
+        element = PageElement(tag, attrs, self._path() + ((tag, index),))
+        self.elements.append(element)
+        
+        if tag == "form":
+            self.forms.append(element)
+        if tag == "a":
+            self._open_anchors.append(element)
+        
+        if tag in VOID_ELEMENTS:
+            counters[tag] = index
+        else:
+            self._push(tag)
+    
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.handle_endtag(tag)
+    
+    def handle_endtag(self, tag):
+        if tag == "a" and self._open_anchors:
+            self._open_anchors.pop()
+        
+        # Close everything up to the matching open tag, ignoring stray end tags
+        for position in range(len(self._stack) - 1, 0, -1):
+            if self._stack[position][0] == tag:
+                del self._stack[position:]
+                return
+    
+    def handle_data(self, data):
+        for anchor in self._open_anchors:
+            anchor.text += data
+
+class SearchPage:
+    """A parsed response from the voucher site."""
+    
+    def __init__(self, url, html):
+        self.url = url
+        parser = PageParser()
+        parser.feed(html)
+        parser.close()
+        self.elements = parser.elements
+        self.forms = parser.forms
+    
+    def find(self, xpath):
+        """Return the elements at an absolute XPath like those used by the Selenium engine."""
+        steps = parse_xpath(xpath)
+        return [element for element in self.elements if element.matches(steps)]
+    
+    def find_by_id(self, element_id):
+        for element in self.elements:
+            if element.attrs.get("id") == element_id:
+                return element
+        return None
+    
+    def is_search_form(self):
+        return self.find_by_id(SERIAL_INPUT_ID) is not None
+    
+    def form_action(self):
+        """Absolute URL the main form posts back to."""
+        action = self.forms[0].attrs.get("action", "") if self.forms else ""
+        return urljoin(self.url, action or self.url)
+    
+    def form_fields(self):
+        """
+        The values a browser would submit with the main form, excluding buttons.
+        
+        Returns:
+            dict: Field name to value, including __VIEWSTATE and __EVENTVALIDATION
+        """
+        fields = {}
+        form_path = self.forms[0].path if self.forms else ()
+        for element in self.elements:
+            if element.tag != "input" or element.path[:len(form_path)] != form_path:
+                continue
+            name = element.attrs.get("name")
+            input_type = element.attrs.get("type", "text").lower()
+            if not name or input_type in BUTTON_INPUT_TYPES:
+                continue
+            if input_type in ("checkbox", "radio") and "checked" not in element.attrs:
+                continue
+            fields[name] = element.attrs.get("value", "")
+        return fields
+    
+    def classify(self):
+        """
+        Work out which result page this is, mirroring classify_outcome.
+        
+        Returns:
+            tuple: (state, abandon_link) where state is one of the OUTCOME_*
+                constants, or (None, None) if the page isn't recognised
+        """
+        for element in self.find(ERROR_MESSAGE_XPATH):
+            if "error msg-block" in element.attrs.get("class", ""):
+                return OUTCOME_INVALID, None
+        
+        if self.find(CLAIM_BUTTON_XPATH):
+            abandon_links = self.find(CLAIM_ABANDON_XPATH)
+            if abandon_links:
+                return OUTCOME_CLAIM_PAGE, abandon_links[0]
+        
+        abandon_links = self.find(SUCCESS_ABANDON_XPATH)
+        if abandon_links:
+            return OUTCOME_SUCCESS_PAGE, abandon_links[0]
+        
+        for element in self.elements:
+            if element.tag == "a" and "Abandon" in element.text:
+                return OUTCOME_GENERIC_ABANDON, element
+        
+        return None, None
+
+_xpath_cache = {}
+
+def parse_xpath(xpath):
+    """
+    Split a simple absolute XPath into (tag, index) steps.
+    
+    Args:
+        xpath (str): Path such as "/html/body/div[1]/form"
+    
+    Returns:
+        tuple: Steps where index is None for steps without a position
+    """
+    steps = _xpath_cache.get(xpath)
+    if steps is None:
+        steps = []
+        for step in xpath.strip("/").split("/"):
+            match = re.fullmatch(r"([a-z0-9]+)(?:\[(\d+)\])?", step)
+            if not match:
+                raise ValueError(f"Unsupported XPath step '{step}' in {xpath}")
+            steps.append((match.group(1), int(match.group(2)) if match.group(2) else None))
+        steps = _xpath_cache[xpath] = tuple(steps)
+    return steps
+
+class HttpVoucherSession:
+    """
+    A keep-alive HTTP session against the voucher search page.
+    
+    The session exposes quit() like a WebDriver so it can be used anywhere
+    the automation expects a browser session.
+    """
+    
+    def __init__(self, search_url=SEARCH_URL, cookies=None, user_agent=None, timeout=30):
+        """
+        Args:
+            search_url (str): URL of search.aspx (may point at a local stand-in)
+            cookies (list): Cookies to import, as returned by driver.get_cookies()
+            user_agent (str): User-Agent header to send, e.g. the browser's own
+            timeout (float): Default socket timeout in seconds
+        """
+        self.search_url = search_url
+        self.user_agent = user_agent or "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
+        self.timeout = timeout
+        self.cookies = {}
+        self.page = None
+        self._connection = None
+        self._connection_key = None
+        if cookies:
+            self.import_cookies(cookies)
+    
+    def import_cookies(self, cookies):
+        """
+        Import cookies from a browser login.
+        
+        Args:
+            cookies (list): Dicts with at least 'name' and 'value' keys
+        """
+        for cookie in cookies:
+            self.cookies[cookie["name"]] = cookie["value"]
+    
+    def _connect(self, scheme, netloc):
+        if self._connection is not None and self._connection_key == (scheme, netloc):
+            return self._connection
+        self.close()
+        if scheme == "https":
+            self._connection = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        else:
+            self._connection = http.client.HTTPConnection(netloc, timeout=self.timeout)
+        self._connection_key = (scheme, netloc)
+        return self._connection
+    
+    def _send(self, method, url, body=None, timeout=None):
+        parts = urlsplit(url)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        
+        headers = {
+            "User-Agent": self.user_agent,
+            "Accept": "text/html,application/xhtml+xml",
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+        }
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{name}={value}" for name, value in self.cookies.items())
+        if body is not None:
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+            headers["Origin"] = f"{parts.scheme}://{parts.netloc}"
+            if self.page is not None:
+                headers["Referer"] = self.page.url
+        
+        # A kept-alive connection may have been closed by the server; retry once on a fresh one
+        for attempt in range(2):
+            connection = self._connect(parts.scheme, parts.netloc)
+            try:
+                if connection.sock is None:
+                    connection.connect()
+                connection.sock.settimeout(timeout or self.timeout)
+                connection.request(method, target, body=body, headers=headers)
+                response = connection.getresponse()
+                payload = response.read()
+                break
+            except (http.client.RemoteDisconnected, http.client.CannotSendRequest,
+                    ConnectionResetError, BrokenPipeError):
+                self.close()
+                if attempt:
+                    raise
+        
+        for header in response.msg.get_all("Set-Cookie") or []:
+            parsed = SimpleCookie()
+            parsed.load(header)
+            for name, morsel in parsed.items():
+                self.cookies[name] = morsel.value
+        
+        encoding = (response.getheader("Content-Encoding") or "").lower()
+        if encoding == "gzip":
+            payload = gzip.decompress(payload)
+        elif encoding == "deflate":
+            payload = zlib.decompress(payload)
+        
+        if response.will_close:
+            self.close()
+        return response, payload
+    
+    def request(self, method, url, fields=None, timeout=None):
+        """
+        Send a request, follow redirects, and parse the resulting page.
+        
+        Args:
+            method (str): "GET" or "POST"
+            url (str): Absolute URL
+            fields (dict): Form fields for a POST
+            timeout (float): Socket timeout for this request
+        
+        Returns:
+            SearchPage: The parsed page, also kept as the session's current page
+        """
+        body = urlencode(fields) if fields is not None else None
+        for _ in range(5):
+            response, payload = self._send(method, url, body, timeout)
+            if response.status in (301, 302, 303, 307, 308):
+                url = urljoin(url, response.getheader("Location"))
+                if response.status in (301, 302, 303):
+                    method, body = "GET", None
+                continue
+            if response.status >= 400:
+                raise HttpEngineError(f"HTTP {response.status} from {url}")
+            
+            charset = response.msg.get_content_charset() or "utf-8"
+            self.page = SearchPage(url, payload.decode(charset, errors="replace"))
+            return self.page
+        raise HttpEngineError(f"Too many redirects from {url}")
+    
+    def open_search_page(self, timeout=None):
+        """
+        Load the search page and check the session is logged in.
+        
+        Raises:
+            HttpEngineError: If the search form isn't on the page (e.g. the
+                login has expired and the site redirected elsewhere)
+        """
+        page = self.request("GET", self.search_url, timeout=timeout)
+        if not page.is_search_form():
+            raise HttpEngineError(f"Search form not found at {page.url}; is the session logged in?")
+        return page
+    
+    def lookup(self, serial, pin, timeout=None):
+        """
+        Submit a serial/PIN lookup as the Lookup button postback.
+        
+        Returns:
+            SearchPage: The result page
+        """
+        page = self.page
+        if page is None or not page.is_search_form():
+            page = self.open_search_page(timeout)
+        
+        fields = page.form_fields()
+        fields["__EVENTTARGET"] = ""
+        fields["__EVENTARGUMENT"] = ""
+        fields[page.find_by_id(SERIAL_INPUT_ID).attrs.get("name", "ctl00$cphMain$tbxSerialNo")] = serial
+        fields[page.find_by_id(PIN_INPUT_ID).attrs.get("name", "ctl00$cphMain$tbxPinNo")] = pin
+        button = page.find_by_id(LOOKUP_BUTTON_ID)
+        if button is not None:
+            fields[button.attrs.get("name", "ctl00$cphMain$btnLookup")] = button.attrs.get("value", "Lookup")
+        
+        return self.request("POST", page.form_action(), fields, timeout)
+    
+    def follow(self, link, timeout=None):
+        """
+        Follow a link on the current page, replaying __doPostBack links as
+        form postbacks.
+        
+        Returns:
+            SearchPage: The page the link leads to
+        """
+        page = self.page
+        href = link.attrs.get("href", "")
+        postback = DO_POSTBACK_PATTERN.search(href)
+        if postback:
+            fields = page.form_fields()
+            fields["__EVENTTARGET"] = postback.group(1)
+            fields["__EVENTARGUMENT"] = postback.group(2)
+            return self.request("POST", page.form_action(), fields, timeout)
+        return self.request("GET", urljoin(page.url, href), timeout=timeout)
+    
+    def quit(self):
+        """Close the session's connection (named like WebDriver.quit)."""
+        self.close()
+        self.page = None
+    
+    def close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+        self._connection = None
+        self._connection_key = None
+
+def process_voucher(session, serial, pin, outcome_timeout=OUTCOME_TIMEOUT, details=None):
+    """
+    Process a single voucher over HTTP, with the same contract as the
+    Selenium process_voucher.
+    
+    Args:
+        session (HttpVoucherSession): Logged-in HTTP session
+        serial (str): Serial number to input
+        pin (str): PIN to input
+        outcome_timeout (float): Seconds to wait for the result page
+        details (dict): Optional dict that receives the matched page state
+            ('outcome'), how long it took to arrive ('outcome_wait'), the
+            seconds spent in each phase ('phases') and the type of any
+            exception that ended the lookup ('exception')
+    
+    Returns:
+        bool: True if voucher was successfully claimed, False otherwise
+    """
+    if details is None:
+        details = {}
+    details['outcome'] = None
+    
+    try:
+        started = time.time()
+        with phase_span(details, 'submit'):
+            page = session.lookup(serial, pin, outcome_timeout)
+        with phase_span(details, 'outcome'):
+            state, abandon_link = page.classify()
+        details['outcome'] = state
+        details['outcome_wait'] = time.time() - started
+        
+        if state == OUTCOME_INVALID:
+            # The response is already a fresh search form for the next voucher
+            print(f"Error message detected for {serial} {pin}: Invalid serial/PIN")
+            return False
+        
+        if state is None:
+            print(f"No result page recognised for {serial} {pin}")
+            with phase_span(details, 'reset'):
+                session.open_search_page()
+            return False
+        
+        if state == OUTCOME_CLAIM_PAGE:
+            print(f"Error page detected for {serial} {pin}")
+        elif state == OUTCOME_SUCCESS_PAGE:
+            print(f"Success page detected for {serial} {pin}")
+        else:
+            print(f"Found generic abandon button for {serial} {pin}")
+        
+        # Abandon back to the search form
+        with phase_span(details, 'abandon'):
+            page = session.follow(abandon_link)
+        if not page.is_search_form():
+            with phase_span(details, 'reset'):
+                session.open_search_page()
+        
+        return state == OUTCOME_SUCCESS_PAGE
+    except Exception as e:
+        print(f"Error processing voucher {serial} {pin}: {str(e)}")
+        details['exception'] = type(e).__name__
+        # Try to get back to the search page
+        try:
+            with phase_span(details, 'reset'):
+                session.close()
+                session.open_search_page()
+        except Exception:
+            pass
+        return False